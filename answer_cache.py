@@ -0,0 +1,151 @@
+# answer_cache.py
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _cosine_similarity(a, b, norm_a, norm_b):
+    if not norm_a or not norm_b:
+        return 0.0
+    return sum(x * y for x, y in zip(a, b)) / (norm_a * norm_b)
+
+
+class AnswerCache:
+    # In-process cache of answers keyed on (userid, corpus version, condensed
+    # question). A new upload changes the corpus version, so stale answers are
+    # never served. Lookups try an exact match first. With a
+    # similarity_threshold they then fall back to the most similar cached
+    # question at or above it. ada-002 cosine scores are compressed near 1:
+    # questions differing only in a year or a number usually score above
+    # 0.95, so the default (None) matches exact questions only, and a
+    # threshold should be measured on real traffic before it is set.
+    def __init__(self, max_entries=1000, ttl_seconds=86400, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, entry, now):
+        return now - entry["created"] > self.ttl_seconds
+
+    def _lookup_exact(self, userid, corpus_version, question):
+        # Returns (exact entry or None, candidates for a similarity match)
+        key = (userid, corpus_version, question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry, []
+            if self.similarity_threshold is None:
+                return None, []
+            candidates = [
+                (k, e)
+                for k, e in self._entries.items()
+                if k[:2] == (userid, corpus_version)
+                and e["embedding"] is not None
+                and not self._expired(e, now)
+            ]
+        return None, candidates
+
+    def _lookup_similar(self, question, candidates, question_embedding):
+        norm = math.sqrt(sum(x * x for x in question_embedding))
+        best_key, best_entry, best_similarity = None, None, 0.0
+        for k, e in candidates:
+            similarity = _cosine_similarity(question_embedding, e["embedding"], norm, e["norm"])
+            if similarity > best_similarity:
+                best_key, best_entry, best_similarity = k, e, similarity
+        if best_entry is not None and best_similarity >= self.similarity_threshold:
+            with self._lock:
+                if best_key in self._entries:
+                    self._entries.move_to_end(best_key)
+                self.similar_hits += 1
+            logger.info(
+                f"Answer cache hit for '{question}' via '{best_key[2]}' "
+                f"(similarity {best_similarity:.3f})"
+            )
+            return best_entry, best_similarity
+        return None, 0.0
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+        return None, 0.0
+
+    def lookup(self, userid, corpus_version, question, embed_query=None):
+        # Returns (entry, similarity, question_embedding); entry is None on a
+        # miss. The question is only embedded when there are cached
+        # questions to compare it with; question_embedding is None otherwise.
+        entry, candidates = self._lookup_exact(userid, corpus_version, question)
+        if entry is not None:
+            return entry, 1.0, entry["embedding"]
+        if embed_query is None or not candidates:
+            return (*self._miss(), None)
+        question_embedding = embed_query(question)
+        entry, similarity = self._lookup_similar(question, candidates, question_embedding)
+        if entry is None:
+            self._miss()
+        return entry, similarity, question_embedding
+
+    async def alookup(self, userid, corpus_version, question, aembed_query=None):
+        # lookup with the question embedding awaited
+        entry, candidates = self._lookup_exact(userid, corpus_version, question)
+        if entry is not None:
+            return entry, 1.0, entry["embedding"]
+        if aembed_query is None or not candidates:
+            return (*self._miss(), None)
+        question_embedding = await aembed_query(question)
+        entry, similarity = self._lookup_similar(question, candidates, question_embedding)
+        if entry is None:
+            self._miss()
+        return entry, similarity, question_embedding
+
+    def store(
+        self,
+        userid,
+        corpus_version,
+        question,
+        answer,
+        source_documents,
+        question_embedding=None,
+    ):
+        norm = 0.0
+        if question_embedding:
+            norm = math.sqrt(sum(x * x for x in question_embedding))
+        with self._lock:
+            self._entries[(userid, corpus_version, question)] = {
+                "answer": answer,
+                "source_documents": source_documents,
+                "embedding": question_embedding,
+                "norm": norm,
+                "created": time.time(),
+            }
+            self._entries.move_to_end((userid, corpus_version, question))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, userid):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == userid]:
+                del self._entries[key]
+
+    def stats(self):
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0,
+        }
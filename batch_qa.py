@@ -0,0 +1,185 @@
+# batch_qa.py
+#
+# Headless question answering over one user's corpus, e.g. for evaluation
+# sets. Questions are read from JSONL ({"id": ..., "question": ...}, id
+# defaults to the line number), answers are appended to the output JSONL as
+# they complete. Re-running with the same output skips every question that
+# already has an answer, so an interrupted run resumes where it stopped.
+#
+#   python batch_qa.py --user alice --questions eval.jsonl --output answers.jsonl
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+batch_qa_concurrency = int(os.environ.get("BATCH_QA_CONCURRENCY", 8))
+
+
+def normalize_question(question):
+    # Questions differing only in case or whitespace share one retrieval
+    return " ".join(question.split()).casefold()
+
+
+def read_questions(path):
+    # Returns [(id, question)]
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            questions.append((str(record.get("id", line_number)), record["question"]))
+    return questions
+
+
+def read_answered(path):
+    # IDs already answered in an earlier run; failed questions are retried.
+    # A line cut off by an interruption is ignored.
+    answered = set()
+    if not os.path.exists(path):
+        return answered
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "answer" in record:
+                answered.add(record["id"])
+    return answered
+
+
+def _ends_mid_line(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def _source_summary(docs):
+    return [
+        {
+            "source": os.path.basename(doc.metadata.get("source", "")),
+            "page": doc.metadata.get("page"),
+        }
+        for doc in docs
+    ]
+
+
+async def arun_batch(userid, questions, output_path, concurrency=None):
+    # questions: [(id, question)]. Each distinct question is retrieved and
+    # answered once and the result written for every ID asking it; at most
+    # `concurrency` questions are in flight at a time.
+    # Returns {"answered", "failed", "skipped"} counts.
+    from http_pool import use_shared_openai_session
+    from metrics import track
+    from utils import aload_user_db, create_user_qa_chain, user_vectordb_directory
+
+    if not os.path.exists(user_vectordb_directory(userid)):
+        raise ValueError(f"User {userid} has no vector store")
+    use_shared_openai_session()
+    answered = read_answered(output_path)
+    groups = {}
+    for question_id, question in questions:
+        if question_id not in answered:
+            groups.setdefault(normalize_question(question), []).append((question_id, question))
+    n_pending = sum(map(len, groups.values()))
+    counts = {"answered": 0, "failed": 0, "skipped": len(questions) - n_pending}
+    logger.info(
+        f"Batch for user {userid}: {n_pending} questions to answer, "
+        f"{len(groups)} distinct, {counts['skipped']} already answered"
+    )
+
+    vectordb = await aload_user_db(userid)
+    qa = await asyncio.to_thread(create_user_qa_chain, userid, vectordb)
+    semaphore = asyncio.Semaphore(concurrency or batch_qa_concurrency)
+
+    directory = os.path.dirname(output_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    cut_off = _ends_mid_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as output:
+        # Start on a fresh line after a run that was cut off mid-write
+        if cut_off:
+            output.write("\n")
+
+        def write(record):
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+        async def answer(group):
+            question = group[0][1]
+            started = time.perf_counter()
+            async with semaphore:
+                try:
+                    with track("retrieval") as span:
+                        docs = await qa.retriever.aget_relevant_documents(question)
+                        span["chunks"] = len(docs)
+                    with track("generation", chunks=len(docs)):
+                        text = await qa.combine_docs_chain.arun(
+                            input_documents=docs, question=question, chat_history=""
+                        )
+                except Exception as e:
+                    logger.exception(f"Batch question '{question}' failed")
+                    for question_id, asked in group:
+                        write(
+                            {
+                                "id": question_id,
+                                "question": asked,
+                                "error": f"{e.__class__.__name__}: {e}",
+                            }
+                        )
+                    counts["failed"] += len(group)
+                    return
+            seconds = round(time.perf_counter() - started, 3)
+            for question_id, asked in group:
+                write(
+                    {
+                        "id": question_id,
+                        "question": asked,
+                        "answer": text,
+                        "sources": _source_summary(docs),
+                        "seconds": seconds,
+                    }
+                )
+            counts["answered"] += len(group)
+
+        await asyncio.gather(*(answer(group) for group in groups.values()))
+    logger.info(f"Batch for user {userid} finished: {counts}")
+    return counts
+
+
+def run_batch(userid, questions_path, output_path, concurrency=None):
+    from http_pool import close_http_sessions
+
+    async def run():
+        try:
+            return await arun_batch(
+                userid, read_questions(questions_path), output_path, concurrency
+            )
+        finally:
+            await close_http_sessions()
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions")
+    parser.add_argument("--user", required=True, help="user ID whose corpus is queried")
+    parser.add_argument("--questions", required=True, help="input JSONL")
+    parser.add_argument("--output", required=True, help="output JSONL, appended to")
+    parser.add_argument("--concurrency", type=int, default=batch_qa_concurrency)
+    args = parser.parse_args()
+    counts = run_batch(args.user, args.questions, args.output, args.concurrency)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
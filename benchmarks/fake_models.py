@@ -0,0 +1,75 @@
+# benchmarks/fake_models.py
+
+import hashlib
+from typing import List
+
+import numpy as np
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+
+
+class FakeEmbeddings(Embeddings):
+    # Deterministic local stand-in for OpenAIEmbeddings: the same text always
+    # maps to the same unit vector, and nothing leaves the machine
+    def __init__(self, dim=1536):
+        self.dim = dim
+        self.model = f"fake-embedding-{dim}"
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+class FakeChatModel(BaseChatModel):
+    # Deterministic local stand-in for ChatOpenAI: answers with the tail of
+    # the prompt and streams it in short pieces, one callback per piece, so
+    # the streaming code paths run exactly as they do against the API
+    model_name: str = "fake-chat"
+    answer_chars: int = 240
+    piece_chars: int = 4
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages):
+        text = messages[-1].content[-self.answer_chars :]
+        return [text[i : i + self.piece_chars] for i in range(0, len(text), self.piece_chars)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        pieces = self._answer(messages)
+        if run_manager:
+            for piece in pieces:
+                run_manager.on_llm_new_token(piece)
+        message = AIMessage(content="".join(pieces))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        pieces = self._answer(messages)
+        if run_manager:
+            for piece in pieces:
+                await run_manager.on_llm_new_token(piece)
+        message = AIMessage(content="".join(pieces))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def synthetic_texts(n, words_per_text=60, seed=0):
+    vocabulary = [f"term{i}" for i in range(5000)] + ["论文", "模型", "实验", "数据", "方法"]
+    rng = np.random.default_rng(seed)
+    return [
+        " ".join(rng.choice(vocabulary, size=words_per_text).tolist()) for _ in range(n)
+    ]
@@ -0,0 +1,86 @@
+# benchmarks/mmr_retrieval.py
+#
+# Per-query MMR retrieval latency at 1k/10k/100k chunks: the batched NumPy
+# MMR used by MMRRetriever against langchain's default implementation,
+# both over the same fetch_k candidates and stored embeddings.
+#
+#   python -m benchmarks.mmr_retrieval --chunks 1000 10000 100000
+
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from langchain.vectorstores.utils import maximal_marginal_relevance as langchain_mmr
+
+from numpy_vectorstore import NumpyVectorStore, normalize
+from retrieval import mmr_search_by_vector
+
+
+class ArrayEmbeddings:
+    # "chunk-i" embeds to row i of a pre-generated matrix
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def embed_documents(self, texts):
+        return self.matrix[[int(text.split("-")[1]) for text in texts]]
+
+    def embed_query(self, text):
+        return self.matrix[int(text.split("-")[1])]
+
+
+def bench(n_chunks, dim, n_queries, k, fetch_k, lambda_mult, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = normalize(rng.standard_normal((n_chunks, dim), dtype=np.float32))
+    queries = normalize(rng.standard_normal((n_queries, dim), dtype=np.float32))
+    directory = tempfile.mkdtemp(prefix="bench-mmr-")
+    try:
+        vectordb = NumpyVectorStore(directory, ArrayEmbeddings(matrix))
+        for start in range(0, n_chunks, 10000):
+            texts = [f"chunk-{i}" for i in range(start, min(start + 10000, n_chunks))]
+            vectordb.add_texts(texts, ids=texts)
+
+        batched, baseline = [], []
+        for query in queries:
+            started = time.perf_counter()
+            mmr_search_by_vector(vectordb, query, k, fetch_k, lambda_mult)
+            batched.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            rows, _ = vectordb._top_rows(query, fetch_k)
+            selected = langchain_mmr(
+                query, vectordb.get_vectors(rows), lambda_mult=lambda_mult, k=k
+            )
+            vectordb._documents(rows[selected])
+            baseline.append(time.perf_counter() - started)
+        return {
+            "chunks": n_chunks,
+            "batched_p50_ms": statistics.median(batched) * 1000,
+            "langchain_p50_ms": statistics.median(baseline) * 1000,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MMR retrieval latency")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>7} {'batched p50 ms':>15} {'langchain p50 ms':>17}")
+    for n_chunks in args.chunks:
+        r = bench(n_chunks, args.dim, args.queries, args.k, args.fetch_k, args.lambda_mult)
+        print(
+            f"{r['chunks']:>7} {r['batched_p50_ms']:>15.2f} {r['langchain_p50_ms']:>17.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# benchmarks/pipeline.py
+#
+# End-to-end ingest and QA benchmark on synthetic English and Chinese PDFs,
+# with deterministic local embedding and chat models, so no API key or
+# network access is used (tiktoken's encoding file must be cached once).
+# Per-stage numbers come from the metrics trace the pipeline writes anyway.
+#
+#   python -m benchmarks.pipeline --pages 5 50 200 --output results.json
+#   python -m benchmarks.pipeline --compare baseline.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks.synthetic_pdfs import synthetic_page_lines, write_pdf
+
+
+def _configure_environment(work_dir, backend, splitter):
+    # utils reads its settings at import time, so this runs before importing it
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("LLM_NAME", "fake-chat")
+    os.environ["USER_FILES_DIRECTORY"] = os.path.join(work_dir, "users")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(work_dir, "embedding_cache.sqlite3")
+    os.environ["METRICS_TRACE_PATH"] = os.path.join(work_dir, "trace.jsonl")
+    os.environ["VECTOR_BACKEND"] = backend
+    os.environ["SPLITTER_MODE"] = splitter
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None}
+    p50, p95 = np.percentile(np.asarray(seconds) * 1000, [50, 95])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3)}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize_trace(trace_path):
+    # Per stage: count, p50/p95, total seconds, items per second, peak RSS
+    records = defaultdict(list)
+    if os.path.exists(trace_path):
+        with open(trace_path, encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                records[record["stage"]].append(record)
+    stages = {}
+    for stage, rows in sorted(records.items()):
+        total = sum(row["seconds"] for row in rows)
+        summary = {
+            "count": len(rows),
+            "errors": sum(1 for row in rows if row["error"]),
+            "total_seconds": round(total, 4),
+            **_percentiles([row["seconds"] for row in rows]),
+            "peak_rss_mb": round(
+                max(row.get("peak_rss_bytes", 0) for row in rows) / 2**20, 1
+            ),
+        }
+        for name in ("pages", "chunks", "tokens"):
+            count = sum(row.get(name) or 0 for row in rows)
+            if count:
+                summary[name] = count
+                summary[f"{name}_per_second"] = round(count / total, 1) if total else None
+        stages[stage] = summary
+    return stages
+
+
+def bench_ingest(utils, pdf_dir, language, n_pages, n_files):
+    # The first file creates the user's store, the rest are added to it
+    userid = f"bench-{language}-{n_pages}p"
+    files = []
+    for i in range(n_files):
+        path = os.path.join(pdf_dir, f"{language}-{n_pages}p-{i}.pdf")
+        files.append(write_pdf(path, synthetic_page_lines(language, n_pages, seed=i)))
+
+    rows = []
+    for step, file_list in (("create", files[:1]), ("add", files[1:])):
+        if not file_list:
+            continue
+        started = time.perf_counter()
+        if step == "create":
+            utils.create_user_vectordb_with_initial_files(file_list, userid)
+        else:
+            utils.load_and_add_new_files_to_user_db(file_list, userid)
+        seconds = time.perf_counter() - started
+        manifest = utils.load_user_manifest(userid)
+        names = {os.path.basename(file) for file in file_list}
+        n_chunks = sum(
+            len(entry["chunk_ids"]) for name, entry in manifest.files.items() if name in names
+        )
+        pages = n_pages * len(file_list)
+        rows.append(
+            {
+                "language": language,
+                "pages_per_file": n_pages,
+                "step": step,
+                "files": len(file_list),
+                "pages": pages,
+                "chunks": n_chunks,
+                "seconds": round(seconds, 4),
+                "pages_per_second": round(pages / seconds, 2),
+                "chunks_per_second": round(n_chunks / seconds, 2),
+            }
+        )
+    return userid, rows
+
+
+def bench_qa(utils, userid, language, n_pages, n_questions, chat_model_cls):
+    # One conversation per corpus, so every question after the first also
+    # goes through the condense step
+    qa = utils.create_qa_chain(
+        utils.load_user_db(userid),
+        llm=chat_model_cls(),
+        condense_question_llm=chat_model_cls(),
+        memory_max_tokens=utils.memory_max_tokens,
+    )
+    from http_pool import close_http_sessions
+
+    lines = [line for page in synthetic_page_lines(language, 1, seed=99) for line in page]
+    latencies, first_token = [], []
+
+    async def ask_all():
+        try:
+            for question in lines[:n_questions]:
+                started = time.perf_counter()
+                first = None
+                async for event in utils.astream_qa_chain(qa, question):
+                    if first is None and "token" in event:
+                        first = time.perf_counter() - started
+                latencies.append(time.perf_counter() - started)
+                first_token.append(first or latencies[-1])
+        finally:
+            await close_http_sessions()
+
+    asyncio.run(ask_all())
+    total = sum(latencies)
+    return {
+        "language": language,
+        "pages_per_file": n_pages,
+        "questions": len(latencies),
+        "questions_per_second": round(len(latencies) / total, 2) if total else None,
+        "latency": _percentiles(latencies),
+        "time_to_first_token": _percentiles(first_token),
+    }
+
+
+def compare(results, baseline):
+    print(f"{'stage':<16} {'p50 ms':>10} {'baseline':>10} {'change':>8}")
+    for stage, summary in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p50_ms")
+        after = summary["p50_ms"]
+        change = "n/a"
+        if before and after is not None:
+            change = f"{(after - before) / before:+.1%}"
+        print(f"{stage:<16} {str(after):>10} {str(before):>10} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingest and QA benchmark")
+    parser.add_argument("--languages", nargs="+", default=["en", "zh"])
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--files", type=int, default=2, help="PDFs per language and size")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "numpy"])
+    parser.add_argument("--splitter", default="compat", choices=["compat", "fast", "langchain"])
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="chatpdf-bench-")
+    _configure_environment(work_dir, args.backend, args.splitter)
+    pdf_dir = os.path.join(work_dir, "pdfs")
+    os.makedirs(pdf_dir)
+
+    import utils
+    from benchmarks.fake_models import FakeChatModel, FakeEmbeddings
+    from embedding_cache import CachedEmbeddings
+
+    # Same cache layer as production, only the OpenAI call is replaced
+    utils._embedding = CachedEmbeddings(
+        FakeEmbeddings(args.dim),
+        utils.get_embedding_cache(),
+        query_cache=utils.query_embedding_cache,
+    )
+
+    started = time.perf_counter()
+    ingest, qa = [], []
+    try:
+        for language in args.languages:
+            for n_pages in args.pages:
+                userid, rows = bench_ingest(utils, pdf_dir, language, n_pages, args.files)
+                ingest += rows
+                qa.append(
+                    bench_qa(utils, userid, language, n_pages, args.questions, FakeChatModel)
+                )
+                print(json.dumps(rows[-1], ensure_ascii=False))
+                print(json.dumps(qa[-1], ensure_ascii=False))
+
+        results = {
+            "meta": {
+                "commit": _git_commit(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "backend": args.backend,
+                "splitter": args.splitter,
+                "args": vars(args),
+                "wall_seconds": round(time.perf_counter() - started, 2),
+            },
+            "ingest": ingest,
+            "qa": qa,
+            "stages": summarize_trace(os.environ["METRICS_TRACE_PATH"]),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# benchmarks/startup.py
+#
+# Cold start benchmark: how long a fresh process takes to import the app's
+# modules, and to answer its first question over an existing corpus
+# (import, open the store, build the chain, first token, full answer).
+# Every measurement runs in a new interpreter, so nothing is already
+# imported or cached in memory; models are the local fakes from
+# benchmarks.fake_models.
+#
+#   python -m benchmarks.startup --output startup.json
+#   python -m benchmarks.startup --compare startup-baseline.json
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.pipeline import _configure_environment, _git_commit
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_USER = "bench-startup"
+
+# module name -> file, for modules whose file name is not importable as is
+IMPORT_TARGETS = {
+    "utils": None,
+    "ingest_jobs": None,
+    "gradio-app": "gradio-app.py",
+}
+
+
+def _run_child(args, env):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", *args],
+        cwd=REPO_DIRECTORY,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Child {args[0]} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _import_module(name):
+    file_name = IMPORT_TARGETS.get(name)
+    if file_name is None:
+        importlib.import_module(name)
+        return
+    spec = importlib.util.spec_from_file_location(
+        name.replace("-", "_"), os.path.join(REPO_DIRECTORY, file_name)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+
+def child_import(name):
+    started = time.perf_counter()
+    _import_module(name)
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "chromadb_loaded": "chromadb" in sys.modules}
+
+
+def child_build(work_dir, n_pages):
+    import utils
+    from benchmarks.fake_models import FakeEmbeddings
+    from benchmarks.synthetic_pdfs import synthetic_page_lines, write_pdf
+    from embedding_cache import CachedEmbeddings
+
+    utils._embedding = CachedEmbeddings(
+        FakeEmbeddings(),
+        utils.get_embedding_cache(),
+        query_cache=utils.query_embedding_cache,
+    )
+    path = os.path.join(work_dir, "startup.pdf")
+    write_pdf(path, synthetic_page_lines("en", n_pages, seed=0))
+    utils.create_user_vectordb_with_initial_files([path], BENCH_USER)
+    return {"pages": n_pages}
+
+
+def child_first_request(started_at):
+    # started_at is the parent's wall clock just before it spawned us, so
+    # interpreter start-up is included in every mark
+    def mark():
+        return time.time() - started_at
+
+    marks = {"interpreter": mark()}
+    import utils
+    from benchmarks.fake_models import FakeChatModel, FakeEmbeddings
+    from embedding_cache import CachedEmbeddings
+    from http_pool import close_http_sessions
+
+    marks["imported"] = mark()
+    utils._embedding = CachedEmbeddings(
+        FakeEmbeddings(),
+        utils.get_embedding_cache(),
+        query_cache=utils.query_embedding_cache,
+    )
+    vectordb = utils.load_user_db(BENCH_USER)
+    marks["store_opened"] = mark()
+    qa = utils.create_qa_chain(
+        vectordb,
+        llm=FakeChatModel(),
+        condense_question_llm=FakeChatModel(),
+        memory_max_tokens=utils.memory_max_tokens,
+    )
+    marks["chain_ready"] = mark()
+
+    async def ask():
+        try:
+            async for event in utils.astream_qa_chain(qa, "What is this document about?"):
+                if "first_token" not in marks and "token" in event:
+                    marks["first_token"] = mark()
+        finally:
+            await close_http_sessions()
+
+    asyncio.run(ask())
+    marks["answered"] = mark()
+    marks["chromadb_loaded"] = "chromadb" in sys.modules
+    return marks
+
+
+def _median(rows, key):
+    return round(statistics.median(row[key] for row in rows) * 1000, 1)
+
+
+def bench_imports(env, repeats):
+    results = {}
+    for name, file_name in IMPORT_TARGETS.items():
+        if name == "gradio-app" and importlib.util.find_spec("gradio") is None:
+            continue
+        rows = [_run_child(["import", name], env) for _ in range(repeats)]
+        results[name] = {
+            "median_ms": _median(rows, "seconds"),
+            "min_ms": round(min(row["seconds"] for row in rows) * 1000, 1),
+            "chromadb_loaded": rows[0]["chromadb_loaded"],
+        }
+        print(json.dumps({"import": name, **results[name]}))
+    return results
+
+
+def bench_first_request(env, repeats):
+    rows = [_run_child(["first-request", repr(time.time())], env) for _ in range(repeats)]
+    stages = ("interpreter", "imported", "store_opened", "chain_ready", "first_token", "answered")
+    result = {f"{stage}_ms": _median(rows, stage) for stage in stages}
+    result["chromadb_loaded"] = rows[0]["chromadb_loaded"]
+    print(json.dumps({"first_request": result}))
+    return result
+
+
+def compare(results, baseline):
+    print(f"{'measurement':<28} {'ms':>10} {'baseline':>10} {'change':>8}")
+    rows = [
+        (f"import {name}", r["median_ms"], baseline.get("imports", {}).get(name, {}).get("median_ms"))
+        for name, r in results["imports"].items()
+    ]
+    rows += [
+        (stage, ms, baseline.get("first_request", {}).get(stage))
+        for stage, ms in results["first_request"].items()
+        if stage.endswith("_ms")
+    ]
+    for label, after, before in rows:
+        change = f"{(after - before) / before:+.1%}" if before else "n/a"
+        print(f"{label:<28} {str(after):>10} {str(before):>10} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold import and first-request benchmark")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=20, help="pages in the test corpus")
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "numpy"])
+    parser.add_argument("--output", default="startup-results.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        kind, *rest = args.child
+        if kind == "import":
+            result = child_import(rest[0])
+        elif kind == "build":
+            result = child_build(rest[0], int(rest[1]))
+        else:
+            result = child_first_request(float(rest[0]))
+        print(json.dumps(result))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="chatpdf-startup-")
+    try:
+        # The children inherit this environment
+        _configure_environment(work_dir, args.backend, "compat")
+        env = dict(os.environ)
+        _run_child(["build", work_dir, str(args.pages)], env)
+        results = {
+            "meta": {
+                "commit": _git_commit(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+            },
+            "imports": bench_imports(env, args.repeats),
+            "first_request": bench_first_request(env, args.repeats),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# benchmarks/stub_embedding_server.py
+#
+# Local stand-in for the OpenAI embeddings endpoint, for exercising
+# EmbeddingScheduler's batching and rate limit handling without an account.
+# Vectors come from benchmarks.fake_models.FakeEmbeddings. With
+# max_concurrency, requests beyond that many in flight get a 429; with
+# rate_limit_first, so do the first n requests. Every request is recorded
+# in `requests` as {"time", "inputs", "status", "in_flight"}.
+#
+#   python -m benchmarks.stub_embedding_server --port 8765 --max-concurrency 4
+#   OPENAI_API_BASE=http://127.0.0.1:8765/v1 python gradio-app.py
+
+import argparse
+import asyncio
+import threading
+import time
+
+from aiohttp import web
+
+from benchmarks.fake_models import FakeEmbeddings
+
+
+class StubEmbeddingServer:
+    def __init__(
+        self,
+        dim=8,
+        delay=0.0,
+        max_concurrency=None,
+        rate_limit_first=0,
+        retry_after=None,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.embeddings = FakeEmbeddings(dim)
+        self.delay = delay
+        self.max_concurrency = max_concurrency
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.requests = []
+        self.in_flight = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def api_base(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def _record(self, inputs, status):
+        self.requests.append(
+            {
+                "time": time.monotonic(),
+                "inputs": inputs,
+                "status": status,
+                "in_flight": self.in_flight,
+            }
+        )
+
+    def _rate_limited(self, inputs):
+        self._record(inputs, 429)
+        headers = {}
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return web.json_response(
+            {"error": {"message": "Rate limit reached", "type": "requests", "code": None}},
+            status=429,
+            headers=headers,
+        )
+
+    async def _handle_embeddings(self, request):
+        body = await request.json()
+        inputs = body["input"]
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self.in_flight += 1
+        try:
+            if len(self.requests) < self.rate_limit_first or (
+                self.max_concurrency is not None and self.in_flight > self.max_concurrency
+            ):
+                return self._rate_limited(inputs)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            self._record(inputs, 200)
+            vectors = self.embeddings.embed_documents(inputs)
+        finally:
+            self.in_flight -= 1
+        return web.json_response(
+            {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": vector}
+                    for i, vector in enumerate(vectors)
+                ],
+                "model": body.get("model"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self._handle_embeddings)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def start(self):
+        # Serves from its own event loop on a daemon thread, so callers can
+        # use asyncio.run freely
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="stub-embedding-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI embeddings server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--delay", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--max-concurrency", type=int, help="429 beyond this many in flight")
+    parser.add_argument("--retry-after", type=float, help="Retry-After sent with a 429")
+    args = parser.parse_args()
+    server = StubEmbeddingServer(
+        dim=args.dim,
+        delay=args.delay,
+        max_concurrency=args.max_concurrency,
+        retry_after=args.retry_after,
+        port=args.port,
+    ).start()
+    print(f"Serving stub embeddings on {server.api_base}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
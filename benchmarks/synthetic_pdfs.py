@@ -0,0 +1,150 @@
+# benchmarks/synthetic_pdfs.py
+#
+# Writes small text-only PDFs without any PDF library. Text is set in a
+# Type0 font with Identity-H encoding and a ToUnicode map, so pdfplumber
+# extracts English and Chinese alike; no glyphs are embedded, the files are
+# meant to be parsed rather than viewed.
+
+import numpy as np
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+FONT_SIZE = 6
+LINE_HEIGHT = 9
+LINES_PER_PAGE = 80
+
+ENGLISH_WORDS = (
+    "attention model transformer layer training data results method baseline "
+    "accuracy loss gradient network embedding retrieval encoder decoder token "
+    "sequence experiment dataset benchmark evaluation performance analysis "
+    "learning representation parameter optimization inference latency memory "
+    "the of and to in for with on by we our this that is are from as"
+).split()
+CHINESE_SENTENCE_ENDS = "。！？；"
+CHINESE_CLAUSE_BREAKS = "，、："
+# Frequent characters, so bigrams repeat the way they do in real text
+CHINESE_CHARACTERS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同"
+    "工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起"
+    "小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平"
+    "形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意"
+    "建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件"
+    "模型论文实验数据方法注意力网络训练检索向量嵌入编码解码评估性能分析学习表示参数优化推理"
+)
+LINE_CHARS = {"en": 90, "zh": 40}
+
+
+def english_text(n_chars, rng):
+    words, length = [], 0
+    while length < n_chars:
+        sentence = rng.choice(ENGLISH_WORDS, size=int(rng.integers(6, 18))).tolist()
+        sentence[0] = sentence[0].capitalize()
+        text = " ".join(sentence) + ". "
+        words.append(text)
+        length += len(text)
+    return "".join(words)[:n_chars]
+
+
+def chinese_text(n_chars, rng):
+    characters = []
+    while len(characters) < n_chars:
+        clause = rng.choice(list(CHINESE_CHARACTERS), size=int(rng.integers(4, 14))).tolist()
+        characters += clause
+        breaks = CHINESE_SENTENCE_ENDS if rng.random() < 0.3 else CHINESE_CLAUSE_BREAKS
+        characters.append(breaks[int(rng.integers(len(breaks)))])
+    return "".join(characters[:n_chars])
+
+
+def synthetic_page_lines(language, n_pages, seed=0):
+    # Returns one list of text lines per page
+    rng = np.random.default_rng(seed)
+    make_text = english_text if language == "en" else chinese_text
+    width = LINE_CHARS[language]
+    pages = []
+    for _ in range(n_pages):
+        text = make_text(width * LINES_PER_PAGE, rng)
+        pages.append([text[i : i + width] for i in range(0, len(text), width)])
+    return pages
+
+
+def _hex(text):
+    # Identity-H: every character is one 2-byte CID, the CID is its code point
+    return "<" + "".join(f"{ord(c):04X}" for c in text if ord(c) <= 0xFFFF) + ">"
+
+
+def _to_unicode_cmap():
+    ranges = [f"<{hi:02X}00> <{hi:02X}FF> <{hi:02X}00>" for hi in range(256)]
+    blocks = []
+    for start in range(0, len(ranges), 100):
+        block = ranges[start : start + 100]
+        blocks.append(f"{len(block)} beginbfrange\n" + "\n".join(block) + "\nendbfrange")
+    return (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+        + "\n".join(blocks)
+        + "\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend"
+    )
+
+
+def _stream(content):
+    data = content.encode("latin-1")
+    return b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+
+def write_pdf(path, page_lines):
+    n_pages = len(page_lines)
+    first_page = 7
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: (
+            "<< /Type /Pages /Count %d /Kids [%s] >>"
+            % (n_pages, " ".join(f"{first_page + 2 * i} 0 R" for i in range(n_pages)))
+        ).encode(),
+        3: (
+            b"<< /Type /Font /Subtype /Type0 /BaseFont /BenchSans /Encoding /Identity-H "
+            b"/DescendantFonts [4 0 R] /ToUnicode 5 0 R >>"
+        ),
+        4: (
+            b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /BenchSans "
+            b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            b"/FontDescriptor 6 0 R /DW 1000 /CIDToGIDMap /Identity >>"
+        ),
+        5: _stream(_to_unicode_cmap()),
+        6: (
+            b"<< /Type /FontDescriptor /FontName /BenchSans /Flags 32 "
+            b"/FontBBox [0 -200 1000 900] /ItalicAngle 0 /Ascent 900 /Descent -200 "
+            b"/CapHeight 700 /StemV 80 >>"
+        ),
+    }
+    for i, lines in enumerate(page_lines):
+        page_id, content_id = first_page + 2 * i, first_page + 2 * i + 1
+        objects[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode()
+        text = "\n".join(f"{_hex(line)} Tj T*" for line in lines)
+        objects[content_id] = _stream(
+            f"BT /F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL 24 {PAGE_HEIGHT - 36} Td\n{text}\nET"
+        )
+
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b"%d 0 obj\n" % object_id + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for object_id in sorted(objects):
+        out += b"%010d 00000 n \n" % offsets[object_id]
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref_offset,
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+def write_synthetic_pdf(path, language, n_pages, seed=0):
+    return write_pdf(path, synthetic_page_lines(language, n_pages, seed))
@@ -0,0 +1,90 @@
+# benchmarks/vector_backends.py
+#
+# Compares open, add and query latency of the Chroma and NumPy backends.
+#
+#   python -m benchmarks.vector_backends --chunks 1000 5000
+
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+
+from langchain.vectorstores import Chroma
+
+from benchmarks.fake_models import FakeEmbeddings, synthetic_texts
+from numpy_vectorstore import NumpyVectorStore
+
+BACKENDS = {"chroma": Chroma, "numpy": NumpyVectorStore}
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def bench_backend(name, n_chunks, n_queries, batch_size, embedding):
+    vectorstore_cls = BACKENDS[name]
+    texts = synthetic_texts(n_chunks)
+    queries = synthetic_texts(n_queries, words_per_text=12, seed=1)
+    directory = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    try:
+        vectordb = vectorstore_cls(persist_directory=directory, embedding_function=embedding)
+        add_seconds = 0.0
+        for start in range(0, n_chunks, batch_size):
+            batch = texts[start : start + batch_size]
+            ids = [f"chunk-{start + i}" for i in range(len(batch))]
+            _, seconds = _timed(lambda: vectordb.add_texts(batch, ids=ids))
+            add_seconds += seconds
+        del vectordb
+
+        vectordb, open_seconds = _timed(
+            lambda: vectorstore_cls(persist_directory=directory, embedding_function=embedding)
+        )
+        similarity, mmr = [], []
+        for query in queries:
+            similarity.append(_timed(lambda: vectordb.similarity_search(query, k=4))[1])
+            mmr.append(
+                _timed(
+                    lambda: vectordb.max_marginal_relevance_search(query, k=4, fetch_k=20)
+                )[1]
+            )
+        return {
+            "backend": name,
+            "chunks": n_chunks,
+            "open_ms": open_seconds * 1000,
+            "add_ms_per_chunk": add_seconds * 1000 / n_chunks,
+            "similarity_p50_ms": statistics.median(similarity) * 1000,
+            "mmr_p50_ms": statistics.median(mmr) * 1000,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare vector backend latency")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    args = parser.parse_args()
+
+    embedding = FakeEmbeddings(args.dim)
+    print(
+        f"{'backend':<8} {'chunks':>7} {'open ms':>9} {'add ms/chunk':>13} "
+        f"{'sim p50 ms':>11} {'mmr p50 ms':>11}"
+    )
+    for n_chunks in args.chunks:
+        for name in args.backends:
+            r = bench_backend(name, n_chunks, args.queries, args.batch_size, embedding)
+            print(
+                f"{r['backend']:<8} {r['chunks']:>7} {r['open_ms']:>9.1f} "
+                f"{r['add_ms_per_chunk']:>13.3f} {r['similarity_p50_ms']:>11.2f} "
+                f"{r['mmr_p50_ms']:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
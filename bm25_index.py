@@ -0,0 +1,201 @@
+# bm25_index.py
+
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+
+from langchain.schema import Document
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Latin words / numbers, or runs of CJK ideographs
+_CJK = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[a-z0-9]+(?:[.\-_][a-z0-9]+)*|[{_CJK}]+")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+_SQL_BATCH_SIZE = 500
+
+# Function words dropped from queries. Question words like "what" or "什么"
+# are rarely in the answering chunk and would keep coverage below 1.
+_QUERY_STOPWORDS = frozenset(
+    "a an and are as at be by can could do does for from how i in is it of on "
+    "or please should that the this to was were what when where which who why "
+    "will with would".split()
+)
+_CJK_QUERY_STOPWORDS = (
+    "为什么", "什么", "怎么", "怎样", "如何", "哪些", "是否", "请问",
+    "哪", "吗", "呢", "吧", "的", "了", "是", "在", "和", "与", "及", "有", "请",
+)
+_CJK_QUERY_STOP_RE = re.compile("|".join(_CJK_QUERY_STOPWORDS))
+
+
+def tokenize(text):
+    # Chinese has no word boundaries, so CJK runs are indexed as character
+    # unigrams plus bigrams; bigrams carry most of the precision for terms
+    # like "注意力" or "卷积网络" without needing a segmentation dictionary
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(match):
+            tokens.extend(match)
+            tokens.extend(match[i : i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+def query_terms(query):
+    # Distinct search terms of a query. CJK runs are split at function words
+    # and contribute only their bigrams: unigrams of a run appear in almost
+    # every Chinese chunk and would dilute coverage. A lone character left
+    # between function words is kept as a unigram. Falls back to all tokens
+    # when the query is nothing but function words.
+    terms = []
+    for match in _TOKEN_RE.findall(query.lower()):
+        if _CJK_RE.match(match):
+            for part in _CJK_QUERY_STOP_RE.split(match):
+                if len(part) == 1:
+                    terms.append(part)
+                terms.extend(part[i : i + 2] for i in range(len(part) - 1))
+        elif match not in _QUERY_STOPWORDS:
+            terms.append(match)
+    return list(dict.fromkeys(terms or tokenize(query)))
+
+
+class BM25Index:
+    # Persistent per-user inverted index stored in SQLite next to the vector
+    # store. search() returns (chunk_id, score, coverage) where coverage is
+    # the share of distinct query terms found in the chunk.
+    def __init__(self, path, k1=1.5, b=0.75):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, "
+            "length INTEGER NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, "
+            "chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (term, chunk_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings(chunk_id)")
+        self._stats = None
+
+    def __len__(self):
+        return self._corpus_stats()[0]
+
+    def _corpus_stats(self):
+        if self._stats is None:
+            n_chunks, avg_length = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM chunks"
+            ).fetchone()
+            self._stats = (n_chunks, avg_length or 0.0)
+        return self._stats
+
+    def _delete(self, chunk_ids):
+        for start in range(0, len(chunk_ids), _SQL_BATCH_SIZE):
+            batch = chunk_ids[start : start + _SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for table in ("postings", "chunks"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE chunk_id IN ({placeholders})", batch
+                )
+
+    def add_documents(self, documents, ids):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._delete(list(ids))
+                for chunk_id, doc in zip(ids, documents):
+                    term_counts = Counter(tokenize(doc.page_content))
+                    self._conn.execute(
+                        "INSERT INTO chunks (chunk_id, length, text, metadata) "
+                        "VALUES (?, ?, ?, ?)",
+                        (
+                            chunk_id,
+                            sum(term_counts.values()),
+                            doc.page_content,
+                            json.dumps(doc.metadata, ensure_ascii=False),
+                        ),
+                    )
+                    self._conn.executemany(
+                        "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                        [(term, chunk_id, tf) for term, tf in term_counts.items()],
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            finally:
+                self._stats = None
+
+    def delete(self, chunk_ids):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._delete(list(chunk_ids))
+            self._conn.execute("COMMIT")
+            self._stats = None
+
+    def search(self, query, k=4):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with self._lock:
+            n_chunks, avg_length = self._corpus_stats()
+            if n_chunks == 0:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            rows = self._conn.execute(
+                "SELECT p.term, p.chunk_id, p.tf, c.length FROM postings p "
+                f"JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+
+        document_frequency = Counter(term for term, _, _, _ in rows)
+        scores = defaultdict(float)
+        matched_terms = defaultdict(int)
+        for term, chunk_id, tf, length in rows:
+            df = document_frequency[term]
+            idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+            scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            matched_terms[chunk_id] += 1
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (chunk_id, score, matched_terms[chunk_id] / len(terms))
+            for chunk_id, score in top
+        ]
+
+    def get_documents_by_id(self, chunk_ids):
+        if not chunk_ids:
+            return {}
+        placeholders = ",".join("?" * len(chunk_ids))
+        with self._lock:
+            return {
+                chunk_id: Document(page_content=text, metadata=json.loads(metadata))
+                for chunk_id, text, metadata in self._conn.execute(
+                    "SELECT chunk_id, text, metadata FROM chunks "
+                    f"WHERE chunk_id IN ({placeholders})",
+                    list(chunk_ids),
+                )
+            }
+
+    def get_documents(self, chunk_ids):
+        found = self.get_documents_by_id(chunk_ids)
+        return [found[chunk_id] for chunk_id in chunk_ids if chunk_id in found]
+
+    def close(self):
+        self._conn.close()
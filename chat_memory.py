@@ -0,0 +1,44 @@
+# chat_memory.py
+
+from typing import List
+
+import tiktoken
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.schema import BaseMessage
+
+# Per-message overhead of the chat format (role, separators)
+_TOKENS_PER_MESSAGE = 4
+
+_encoding = None
+
+
+def count_text_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    return _TOKENS_PER_MESSAGE + count_text_tokens(message.content)
+
+
+class TokenBudgetMemory(ConversationSummaryBufferMemory):
+    # Sliding window of recent messages within max_token_limit tokens plus a
+    # rolling summary of everything older, so the history sent to the condense
+    # step stays bounded however long the session runs.
+    # Messages are counted once each with tiktoken, instead of re-tokenising
+    # the whole buffer after every pop as the base class does.
+    def prune(self) -> None:
+        buffer: List[BaseMessage] = self.chat_memory.messages
+        token_counts = [count_message_tokens(message) for message in buffer]
+        total = sum(token_counts)
+        if total <= self.max_token_limit:
+            return
+        pruned_memory = []
+        while buffer and total > self.max_token_limit:
+            pruned_memory.append(buffer.pop(0))
+            total -= token_counts.pop(0)
+        self.moving_summary_buffer = self.predict_new_summary(
+            pruned_memory, self.moving_summary_buffer
+        )
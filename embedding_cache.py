@@ -0,0 +1,198 @@
+# embedding_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from langchain.embeddings.base import Embeddings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# SQLite refuses statements with more than 999 host parameters on older builds
+_SQL_BATCH_SIZE = 500
+
+
+def make_cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class SQLiteEmbeddingCache:
+    # Content-addressed embedding store on local disk.
+    # Keys are sha256(model, text), values are float32 vectors.
+    # Least recently used rows are evicted once max_entries is exceeded.
+    def __init__(self, path: str, max_entries: int = 200_000):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self):
+        return self._size
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start : start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                        [now, *batch],
+                    )
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._size += max(cursor.rowcount, 0)
+            self._evict()
+
+    def _evict(self):
+        overflow = self._size - self.max_entries
+        if overflow <= 0:
+            return
+        cursor = self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (overflow,),
+        )
+        self._size -= cursor.rowcount
+        self.evictions += cursor.rowcount
+        logger.info(f"Embedding cache evicted {cursor.rowcount} entries")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps any langchain Embeddings (OpenAIEmbeddings in production, a fake
+    # local function in tests) and only forwards texts the cache has not seen.
+    # Query embeddings are also kept in an optional in-memory LRU, so repeated
+    # questions skip both the network and the SQLite lookup.
+    def __init__(
+        self,
+        underlying: Embeddings,
+        cache: SQLiteEmbeddingCache,
+        model_name=None,
+        query_cache=None,
+    ):
+        self.underlying = underlying
+        self.cache = cache
+        self.query_cache = query_cache
+        self.model_name = model_name or getattr(
+            underlying, "model", underlying.__class__.__name__
+        )
+
+    def _lookup(self, texts: List[str], namespace: str):
+        keys = [make_cache_key(namespace, text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # Duplicate chunks within one call are only embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        self.cache.hits += len(texts) - len(missing)
+        self.cache.misses += len(missing)
+        return keys, found, missing
+
+    def _store(self, keys, found, missing, vectors) -> List[List[float]]:
+        if missing:
+            new_items = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            found.update(new_items)
+        return [list(found[key]) for key in keys]
+
+    def _embed(self, texts: List[str], namespace: str, embed_fn) -> List[List[float]]:
+        keys, found, missing = self._lookup(texts, namespace)
+        vectors = embed_fn(list(missing.values())) if missing else []
+        return self._store(keys, found, missing, vectors)
+
+    async def _aembed(
+        self, texts: List[str], namespace: str, aembed_fn
+    ) -> List[List[float]]:
+        # The SQLite lookups are local and short, only the network is awaited
+        keys, found, missing = self._lookup(texts, namespace)
+        vectors = await aembed_fn(list(missing.values())) if missing else []
+        return self._store(keys, found, missing, vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, self.model_name, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is not None:
+            vector = self.query_cache.get((self.model_name, text))
+            if vector is not None:
+                return list(vector)
+        vector = self._embed(
+            [text],
+            f"{self.model_name}#query",
+            lambda texts: [self.underlying.embed_query(texts[0])],
+        )[0]
+        if self.query_cache is not None:
+            self.query_cache.put((self.model_name, text), tuple(vector))
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed(
+            texts, self.model_name, self.underlying.aembed_documents
+        )
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.query_cache is not None:
+            vector = self.query_cache.get((self.model_name, text))
+            if vector is not None:
+                return list(vector)
+
+        async def aembed(texts):
+            return [await self.underlying.aembed_query(texts[0])]
+
+        vector = (await self._aembed([text], f"{self.model_name}#query", aembed))[0]
+        if self.query_cache is not None:
+            self.query_cache.put((self.model_name, text), tuple(vector))
+        return vector
@@ -0,0 +1,237 @@
+# embedding_scheduler.py
+
+import asyncio
+import random
+import threading
+import time
+from typing import List
+
+import openai
+import tiktoken
+from langchain.embeddings.base import Embeddings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The embeddings endpoint accepts at most 2048 inputs per request
+MAX_INPUTS_PER_REQUEST = 2048
+
+_RETRYABLE_ERRORS = (
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+class EmbeddingMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.tokens = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.busy_seconds = 0.0
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            busy = self.busy_seconds
+            return {
+                "requests": self.requests,
+                "texts": self.texts,
+                "tokens": self.tokens,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "busy_seconds": busy,
+                "texts_per_second": self.texts / busy if busy else 0.0,
+                "tokens_per_second": self.tokens / busy if busy else 0.0,
+            }
+
+
+class _AdaptiveLimiter:
+    # Concurrency limit that halves on every 429 and creeps back up by one
+    # on each success (AIMD), so we settle just under the account's rate limit
+    def __init__(self, limit):
+        self.max_limit = limit
+        self.limit = limit
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        # Honour a global pause set by the last rate limited request
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, rate_limited=False, backoff=0.0):
+        async with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self.resume_at = max(self.resume_at, time.monotonic() + backoff)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1)
+            self._cond.notify_all()
+
+
+class EmbeddingScheduler:
+    # Packs texts into token-budgeted batches and keeps `max_concurrency`
+    # embedding requests in flight, backing off adaptively on 429s.
+    # `api_base` can point at a local stub server speaking the OpenAI API.
+    def __init__(
+        self,
+        model="text-embedding-ada-002",
+        max_batch_tokens=16000,
+        max_concurrency=4,
+        max_retries=6,
+        initial_backoff=1.0,
+        max_backoff=60.0,
+        api_base=None,
+        encoding_name="cl100k_base",
+    ):
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.api_base = api_base
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.metrics = EmbeddingMetrics()
+
+    def count_tokens(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def make_batches(self, texts):
+        # Returns (indices, token_count) per batch; an oversized text gets a batch of its own
+        batches = []
+        indices, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            n_tokens = self.count_tokens(text)
+            if indices and (
+                batch_tokens + n_tokens > self.max_batch_tokens
+                or len(indices) >= MAX_INPUTS_PER_REQUEST
+            ):
+                batches.append((indices, batch_tokens))
+                indices, batch_tokens = [], 0
+            indices.append(i)
+            batch_tokens += n_tokens
+        if indices:
+            batches.append((indices, batch_tokens))
+        return batches
+
+    def _backoff(self, attempt, error):
+        retry_after = (getattr(error, "headers", None) or {}).get("retry-after")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(self.max_backoff, self.initial_backoff * 2**attempt)
+        return delay * (0.5 + random.random() / 2)
+
+    async def _request(self, texts):
+        kwargs = {"api_base": self.api_base} if self.api_base else {}
+        response = await openai.Embedding.acreate(input=texts, model=self.model, **kwargs)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    async def _embed_batch(self, texts, n_tokens, limiter):
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            try:
+                vectors = await self._request(texts)
+            except openai.error.RateLimitError as e:
+                if attempt == self.max_retries:
+                    await limiter.release()
+                    raise
+                backoff = self._backoff(attempt, e)
+                logger.info(f"Embedding request rate limited, backing off {backoff:.1f}s")
+                self.metrics.add(rate_limited=1, retries=1)
+                await limiter.release(rate_limited=True, backoff=backoff)
+                continue
+            except _RETRYABLE_ERRORS as e:
+                await limiter.release()
+                if attempt == self.max_retries:
+                    raise
+                self.metrics.add(retries=1)
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            except BaseException:
+                await limiter.release()
+                raise
+            await limiter.release()
+            self.metrics.add(requests=1, texts=len(texts), tokens=n_tokens)
+            return vectors
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        started = time.monotonic()
+        limiter = _AdaptiveLimiter(self.max_concurrency)
+        batches = self.make_batches(texts)
+        try:
+            results = await asyncio.gather(
+                *(
+                    self._embed_batch([texts[i] for i in indices], n_tokens, limiter)
+                    for indices, n_tokens in batches
+                )
+            )
+        finally:
+            self.metrics.add(busy_seconds=time.monotonic() - started)
+        vectors = [None] * len(texts)
+        for (indices, _), batch_vectors in zip(batches, results):
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+        logger.info(f"Embedded {len(texts)} texts in {len(batches)} requests")
+        return vectors
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed(texts))
+        # Called from inside an event loop: run on a helper thread instead
+        result = {}
+
+        def run():
+            try:
+                result["vectors"] = asyncio.run(self.aembed(texts))
+            except BaseException as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["vectors"]
+
+
+class ScheduledEmbeddings(Embeddings):
+    def __init__(self, scheduler: EmbeddingScheduler):
+        self.scheduler = scheduler
+        self.model = scheduler.model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.scheduler.embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.embed([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.scheduler.aembed(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.scheduler.aembed([text]))[0]
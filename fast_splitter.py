@@ -0,0 +1,213 @@
+# fast_splitter.py
+
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+
+from langchain.schema import Document
+
+from chat_memory import count_text_tokens
+
+# Below this many documents a process pool costs more than it saves
+PARALLEL_MIN_DOCUMENTS = 64
+
+# One long-lived pool per process, started from pdf_documents'
+# process_pool_context rather than forked from the threaded app
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            from pdf_documents import process_pool_context
+
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=process_pool_context()
+            )
+            _executor_workers = max_workers
+        return _executor
+
+
+def _discard_executor(executor):
+    # A worker died; the next split starts a new pool
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+# RecursiveCharacterTextSplitter's defaults: one separator per level, each
+# kept at the start of the piece that follows it
+COMPAT_SEPARATORS = [("\n\n",), ("\n",), (" ",), ("",)]
+# Sentence ends come before line breaks: PDF lines wrap mid-sentence, so
+# splitting on "\n" first would start most chunks in the middle of one
+CHINESE_SEPARATORS = [
+    ("\n\n",),
+    ("。", "！", "？", "；", "!", "?"),
+    ("\n",),
+    ("，", "、", "：", ",", ";"),
+    (" ",),
+    ("",),
+]
+ENGLISH_SEPARATORS = [
+    ("\n\n",),
+    (". ", "? ", "! ", ".\n"),
+    ("\n",),
+    ("; ", ", "),
+    (" ",),
+    ("",),
+]
+
+
+class FastTextSplitter:
+    # Recursive splitter that works on (start, end) offsets into the page
+    # text and only slices out the finished chunks, instead of building and
+    # re-joining a string for every intermediate piece.
+    # With the default separators it returns exactly the chunks of
+    # RecursiveCharacterTextSplitter(chunk_size, chunk_overlap).
+    # separator_at_end keeps each separator with the piece before it, so
+    # sentence punctuation ends a chunk instead of starting the next one.
+    # length="tokens" sizes chunks in cl100k tokens instead of characters.
+    def __init__(
+        self,
+        chunk_size,
+        chunk_overlap,
+        separators=COMPAT_SEPARATORS,
+        separator_at_end=False,
+        length="chars",
+    ):
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size "
+                f"({chunk_size}), should be smaller."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separator_at_end = separator_at_end
+        self.length = length
+        # None stands for "", i.e. split into single characters
+        self._patterns = [
+            re.compile("|".join(re.escape(s) for s in level)) if any(level) else None
+            for level in separators
+        ]
+
+    def _lengths(self, text, pieces):
+        if self.length == "tokens":
+            return [count_text_tokens(text[a:b]) for a, b in pieces]
+        return [b - a for a, b in pieces]
+
+    def _select_level(self, text, start, end, level):
+        # First separator level that occurs in text[start:end]
+        for i in range(level, len(self._patterns)):
+            pattern = self._patterns[i]
+            if pattern is None or pattern.search(text, start, end):
+                return i
+        return len(self._patterns) - 1
+
+    def _pieces(self, text, start, end, level):
+        pattern = self._patterns[level]
+        if pattern is None:
+            return [(i, i + 1) for i in range(start, end)]
+        cuts = [
+            match.end() if self.separator_at_end else match.start()
+            for match in pattern.finditer(text, start, end)
+        ]
+        bounds = [start, *cuts, end]
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+    def _emit(self, text, start, end, chunks):
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+
+    def _merge(self, text, pieces, lengths, chunks):
+        # Pieces are contiguous, so a run of them is one slice of the text
+        first = 0
+        total = 0
+        for i, n in enumerate(lengths):
+            if total + n > self.chunk_size and first < i:
+                self._emit(text, pieces[first][0], pieces[i - 1][1], chunks)
+                while total > self.chunk_overlap or (
+                    total + n > self.chunk_size and total > 0
+                ):
+                    total -= lengths[first]
+                    first += 1
+            total += n
+        if first < len(pieces):
+            self._emit(text, pieces[first][0], pieces[-1][1], chunks)
+
+    def _merge_characters(self, text, start, end, chunks):
+        # _merge over single characters in closed form: every chunk is
+        # chunk_size long and the next one starts where the overlap allows
+        step = self.chunk_size - min(self.chunk_overlap, self.chunk_size - 1)
+        first = start
+        while first + self.chunk_size < end:
+            self._emit(text, first, first + self.chunk_size, chunks)
+            first += step
+        if first < end:
+            self._emit(text, first, end, chunks)
+
+    def _split(self, text, start, end, level, chunks):
+        level = self._select_level(text, start, end, level)
+        if self._patterns[level] is None and self.length == "chars" and self.chunk_size > 1:
+            self._merge_characters(text, start, end, chunks)
+            return
+        last_level = level == len(self._patterns) - 1
+        pieces = self._pieces(text, start, end, level)
+        lengths = self._lengths(text, pieces)
+        good = []
+        good_lengths = []
+        for (a, b), n in zip(pieces, lengths):
+            if n < self.chunk_size:
+                good.append((a, b))
+                good_lengths.append(n)
+                continue
+            if good:
+                self._merge(text, good, good_lengths, chunks)
+                good = []
+                good_lengths = []
+            if last_level:
+                chunks.append(text[a:b])
+            else:
+                self._split(text, a, b, level + 1, chunks)
+        if good:
+            self._merge(text, good, good_lengths, chunks)
+
+    def split_text(self, text):
+        chunks = []
+        self._split(text, 0, len(text), 0, chunks)
+        return chunks
+
+    def split_texts(self, texts):
+        return [self.split_text(text) for text in texts]
+
+    def split_documents(self, documents, max_workers=1):
+        # Each document is split on its own, so they can be spread over
+        # processes without changing any boundary
+        documents = list(documents)
+        texts = [doc.page_content for doc in documents]
+        if max_workers > 1 and len(texts) >= PARALLEL_MIN_DOCUMENTS:
+            batch_size = -(-len(texts) // (max_workers * 4))
+            batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+            executor = _get_executor(max_workers)
+            try:
+                chunks_per_text = list(
+                    chain.from_iterable(executor.map(self.split_texts, batches))
+                )
+            except BrokenProcessPool:
+                _discard_executor(executor)
+                raise
+        else:
+            chunks_per_text = self.split_texts(texts)
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc, chunks in zip(documents, chunks_per_text)
+            for chunk in chunks
+        ]
@@ -1,9 +1,14 @@
 # gradio-app.py
 
 import os
+import asyncio
+import atexit
+import inspect
+import signal
+import sys
 import shutil
 import glob
-import pypdf
+import threading
 
 from typing import IO
 
@@ -11,126 +16,181 @@ GRADIO_ANALYTICS_ENABLED = False
 import gradio as gr
 from utils import (
     prettify_source_documents,
-    prettify_chat_history,
-    create_user_vectordb_with_initial_files,
+    prettify_chat_turn,
+    CHAT_HISTORY_HEADER,
     load_user_db,
-    load_and_add_new_files_to_user_db,
-    create_qa_chain,
+    astream_qa_chain,
+    load_user_manifest,
+    rebuild_user_manifest,
+    invalidate_user_db,
+    user_vectordb_directory,
+    answer_cache,
+    create_user_qa_chain,
+    get_shared_store,
+    release_user_files,
 )
+from manifest import UserManifest, file_sha256
+from pdf_documents import InvalidPDFError, check_pdf_structure
+from ingest_jobs import IngestJobQueue, start_ingest_worker, stop_ingest_workers
+from metrics import metrics_port, start_metrics_server
 
 from dotenv import load_dotenv, find_dotenv
 
 _ = load_dotenv(find_dotenv())
 user_files_directory = os.environ["USER_FILES_DIRECTORY"]
+gradio_concurrency = int(os.environ.get("GRADIO_CONCURRENCY", 16))
+gradio_max_queue = int(os.environ.get("GRADIO_MAX_QUEUE", 64))
+ingest_jobs_path = os.environ.get(
+    "INGEST_JOBS_PATH", f"{user_files_directory}/ingest_jobs.sqlite3"
+)
+ingest_workers = int(os.environ.get("INGEST_WORKERS", 1))
+ingest_progress_interval = float(os.environ.get("INGEST_PROGRESS_INTERVAL", 2))
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_user_locks = {}
+_user_locks_lock = threading.Lock()
+
+
+def get_user_lock(userid):
+    # Several browser sessions may log in as the same user; only one of them
+    # may write to that user's docs/ and chroma/ at a time
+    with _user_locks_lock:
+        return _user_locks.setdefault(userid, threading.Lock())
+
+
+ingest_jobs = IngestJobQueue(ingest_jobs_path)
+# Worker slot -> process
+_ingest_worker_processes = {}
+_ingest_workers_lock = threading.Lock()
+
+
+def ensure_ingest_workers():
+    # Each worker imports the whole ingest stack, so they are spawned when
+    # the first job is queued instead of competing with the app's startup.
+    # Called again whenever a job is queued or polled: a worker that died
+    # (e.g. killed while parsing a huge PDF) is replaced, and its job is
+    # handed back to the queue.
+    with _ingest_workers_lock:
+        for i in range(ingest_workers):
+            worker = _ingest_worker_processes.get(i)
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None:
+                logger.warning(
+                    f"Ingest worker {worker.pid} exited with code {worker.exitcode}, restarting"
+                )
+            _ingest_worker_processes[i] = start_ingest_worker(
+                ingest_jobs_path, i, metrics_port
+            )
+        # is_alive() has reaped the dead workers, so their PIDs no longer
+        # look alive to requeue_abandoned
+        ingest_jobs.requeue_abandoned()
+
+
+@atexit.register
+def _stop_ingest_workers():
+    with _ingest_workers_lock:
+        stop_ingest_workers(list(_ingest_worker_processes.values()))
+        _ingest_worker_processes.clear()
+
 
 class AIAssistant:
     def __init__(self, userid):
         self.userid = userid
         self.qa = None
         self.process_status = False
+        self.corpus_version = None
+        self.job_id = None
+        self.chat_history_printout = CHAT_HISTORY_HEADER
 
-    def get_user_existing_files_list(self):
+    def get_user_manifest(self):
         logger.info(f"Checking if user {self.userid} exists...")
 
-        existing_files_basename = []
+        manifest = load_user_manifest(self.userid)
 
         # Check if user exists
-        if os.path.exists(f"{user_files_directory}/{self.userid}"):
-            try:
-                # If user exists, read existing file names
-                with open(
-                    f"{user_files_directory}/{self.userid}/file_list.txt", "r", encoding="utf-8"
-                ) as f:
-                    existing_files_basename = f.read().splitlines()
-            except FileNotFoundError:
-                logger.info(
-                    f"FileNotFoundError User {self.userid} file_list does not exist."
-                )
-                # Check if there are files in the "docs" folder
-                docs_dir = f"{user_files_directory}/{self.userid}/docs"
-                if os.path.exists(docs_dir) and glob.glob(docs_dir + "/*.pdf"):
-                    logger.info("User list corrupted, reloading existing files...")
-                    existing_files_basename = os.listdir(docs_dir)
-                    logger.info(existing_files_basename)
-
-                    # Delete existing db
-                    if os.path.exists(f"{user_files_directory}/{self.userid}/chroma/"):
-                        shutil.rmtree(f"{user_files_directory}/{self.userid}/chroma/")
-                    existing_files_fullpath = [
-                        os.path.join(docs_dir, f) for f in existing_files_basename
-                    ]
-                    _ = create_user_vectordb_with_initial_files(
-                        existing_files_fullpath, self.userid
-                    )
-
-                    # Create file list
-                    with open(
-                        f"{user_files_directory}/{self.userid}/file_list.txt", "w", encoding="utf-8"
-                    ) as f:
-                        f.write("\n".join(existing_files_basename))
-        logger.info(f"Existing files: {existing_files_basename}")
-        return existing_files_basename
-
-    def save_file(
-        self, file: IO, existing_files_basename: list[str]
-    ) -> tuple[str, str]:
-        # if file already exists
+        # While a job is queued or running the store may hold partly written
+        # files, e.g. of a crashed job that was requeued; a manifest rebuilt
+        # from them would make the resumed job skip those files. The worker
+        # writes the manifest itself.
+        if (
+            os.path.exists(f"{user_files_directory}/{self.userid}")
+            and not manifest.exists()
+            and not ingest_jobs.active_job(self.userid)
+        ):
+            logger.info(
+                f"User {self.userid} manifest does not exist, rebuilding from chroma metadata..."
+            )
+            manifest = rebuild_user_manifest(self.userid)
+        logger.info(f"Existing files: {list(manifest.files)}")
+        return manifest
+
+    def find_unindexed_files(self, manifest):
+        # Files saved to "docs" that never made it into the vector store,
+        # e.g. because the app stopped before their ingest job was queued
+        docs_dir = f"{user_files_directory}/{self.userid}/docs"
+        return [
+            f
+            for f in sorted(glob.glob(docs_dir + "/*.pdf"))
+            if os.path.basename(f) not in manifest.files
+        ]
+
+    def save_file(self, file: IO, manifest: UserManifest) -> tuple[str, str]:
+        # if file with the same content already exists
         # return (None, "file already exists")
-        # if file does not exist
+        # if file is new or its content changed
         # save file and
         # return (file_path, None)
         if not os.path.exists(f"{user_files_directory}/{self.userid}/docs"):
             os.makedirs(f"{user_files_directory}/{self.userid}/docs")
 
         base_file_name = os.path.basename(file.name)
+        file_hash = file_sha256(file.name)
 
-        # Check if file already exists in the list
-        if base_file_name in existing_files_basename:
+        # Check if the same content is already indexed
+        existing_entry = manifest.files.get(base_file_name)
+        if existing_entry and existing_entry["sha256"] == file_hash:
             return None, f"File '{base_file_name}' already exists."
+        same_content_file = manifest.find_by_hash(file_hash)
+        if same_content_file:
+            return None, f"File '{base_file_name}' is identical to '{same_content_file}'."
 
-        # Save new file
+        # Save new or changed file, changed files are re-embedded on ingest.
+        # With the shared store the file is a hardlink to its single copy.
         saved_file_fullpath = os.path.join(
             f"{user_files_directory}/{self.userid}/docs", base_file_name
         )
-        shutil.move(file.name, saved_file_fullpath)
+        shared_store = get_shared_store()
+        if shared_store is not None:
+            shared_store.add_file(
+                self.userid, base_file_name, file.name, saved_file_fullpath, file_hash
+            )
+        else:
+            shutil.move(file.name, saved_file_fullpath)
 
         return saved_file_fullpath, None
 
     def save_files(self, files):
         # Save files to {user_files_directory}/userid/docs
-        # Get only new added file paths
-        # Write to {user_files_directory}/userid/file_list.txt
-        # Return list of only new added file paths
-        added_files_fullpaths = []
+        # Return list of only new or changed file paths,
+        # {user_files_directory}/userid/manifest.json is updated on ingest
         already_exist_messages = []
-        existing_files_basename = self.get_user_existing_files_list()
-
-        for file in files:
-            saved_file_fullpath, message = self.save_file(file, existing_files_basename)
-            if saved_file_fullpath:
+        manifest = self.get_user_manifest()
+        added_files_fullpaths = self.find_unindexed_files(manifest)
+        if added_files_fullpaths:
+            logger.info(f"Indexing files missing from manifest: {added_files_fullpaths}")
+
+        for file in files or []:
+            saved_file_fullpath, message = self.save_file(file, manifest)
+            if saved_file_fullpath and saved_file_fullpath not in added_files_fullpaths:
                 added_files_fullpaths.append(saved_file_fullpath)
             if message:
                 already_exist_messages.append(message)
 
-        # Update file list
-        with open(
-            f"{user_files_directory}/{self.userid}/file_list.txt", "w", encoding="utf-8"
-        ) as f:
-            f.write(
-                "\n".join(
-                    [
-                        os.path.basename(fp)
-                        for fp in added_files_fullpaths + existing_files_basename
-                    ]
-                )
-            )
-
         return added_files_fullpaths, already_exist_messages
 
     def process_file_and_load_user_profile(self, files):
@@ -138,68 +198,142 @@ class AIAssistant:
             process_message = "请先输入用户ID -- Please enter a user ID first"
             return process_message
 
-        else:
-            existing_user = os.path.exists(f"{user_files_directory}/{self.userid}")
-            if existing_user:
-                if files is not None:
-                    logger.info(f"Existing user, file not None")
-                    added_file_fullpaths, _ = self.save_files(files)
-                    logger.info(f"Added files: {added_file_fullpaths}")
-                    logger.info(f"Current working directory: {os.getcwd()}")
-                    if added_file_fullpaths == []:
-                        vectordb = load_user_db(self.userid)
-                    else:
-                        vectordb = load_and_add_new_files_to_user_db(
-                            added_file_fullpaths, self.userid
-                        )
-                else:  # no new files
-                    logger.info(f"Existing user, file None")
-                    vectordb = load_user_db(self.userid)
-                logger.info(f"Crate qa chain with vectordb")
-                self.qa = create_qa_chain(vectordb)
-                self.process_status = True
-                process_message = "文件已分析完毕 Files have been processed."
-
-            else:  # new user
-                if files is not None:
-                    # save files and create user db
-                    added_file_fullpaths, _ = self.save_files(files)
-                    process_message, vectordb = create_user_vectordb_with_initial_files(
-                        added_file_fullpaths, self.userid
-                    )
-                    self.qa = create_qa_chain(vectordb)
-                    self.process_status = True
-                else:
-                    process_message = "请先上传文件 Please upload a file first."
-                    return process_message
+        with get_user_lock(self.userid):
+            return self._process_file_and_load_user_profile(files)
 
-        return process_message
+    async def aprocess_file_and_load_user_profile(self, files):
+        # Only moves files and queues a job, the lock is waited for off the loop
+        return await asyncio.to_thread(self.process_file_and_load_user_profile, files)
 
-    def get_answer(self, question):
-        if self.process_status:
-            result = self.qa({"question": question})
-            logger.info(result["answer"])
-            logger.info(result)
-            return (
-                result["answer"],
-                prettify_chat_history(result),
-                prettify_source_documents(result),
-                result["generated_question"],
+    def _process_file_and_load_user_profile(self, files):
+        # Saving the uploads is quick; parsing and embedding them runs in the
+        # ingest workers, and the UI polls check_ingest_job for progress
+        existing_user = os.path.exists(user_vectordb_directory(self.userid))
+        if files is None and not os.path.exists(f"{user_files_directory}/{self.userid}"):
+            process_message = "请先上传文件 Please upload a file first."
+            return process_message
+
+        added_file_fullpaths, _ = self.save_files(files)
+        logger.info(f"Added files: {added_file_fullpaths}")
+        if existing_user:
+            # The current files stay searchable while new ones are ingested
+            self.load_user_profile()
+            process_message = "文件已分析完毕 Files have been processed."
+        if added_file_fullpaths:
+            self.job_id = ingest_jobs.enqueue(self.userid, added_file_fullpaths)
+            ensure_ingest_workers()
+            process_message = (
+                f"已提交分析任务 {self.job_id}，共 {len(added_file_fullpaths)} 个文件 -- "
+                f"Ingest job {self.job_id} queued with {len(added_file_fullpaths)} files"
             )
+        elif not existing_user:
+            process_message = "请先上传文件 Please upload a file first."
+        return process_message
 
-        else:
+    def load_user_profile(self):
+        vectordb = load_user_db(self.userid)
+        logger.info(f"Crate qa chain with vectordb")
+        self.qa = create_user_qa_chain(self.userid, vectordb)
+        self.process_status = True
+        # Cached answers are only valid for this exact set of files
+        self.corpus_version = load_user_manifest(self.userid).version()
+
+    def check_ingest_job(self):
+        # Returns a progress message for the current job, or None without one.
+        # Once the job is done the user's store is re-opened, since it was
+        # written by a worker process.
+        if self.job_id is None:
+            return None
+        job = ingest_jobs.get(self.job_id)
+        if job is None:
+            self.job_id = None
+            return None
+        if job["status"] in ("queued", "running"):
+            ensure_ingest_workers()
+        lines = [f"分析任务 Ingest job {job['job_id']}: {job['status']}", ""]
+        invalid_files = []
+        for entry in job["files"]:
+            details = ", ".join(
+                f"{key} {entry[key]}" for key in ("pages", "chunks", "error") if key in entry
+            )
+            if entry["stage"] == "invalid":
+                invalid_files.append(os.path.basename(entry["file"]))
+            lines.append(
+                f"- {os.path.basename(entry['file'])}: {entry['stage']}"
+                + (f" ({details})" if details else "")
+            )
+        if job["status"] == "done":
+            self.job_id = None
+            invalidate_user_db(self.userid)
+            self.load_user_profile()
+            lines += ["", "文件已分析完毕 Files have been processed."]
+            if invalid_files:
+                lines += [
+                    "",
+                    "以下PDF文件无法读取，已删除 -- The following PDF files could not be "
+                    f"properly loaded and were removed: {', '.join(invalid_files)}",
+                ]
+        elif job["status"] == "failed":
+            self.job_id = None
+            lines += ["", f"分析失败 Ingest failed: {job['error']}"]
+        elif job["status"] == "cancelled":
+            self.job_id = None
+            lines += ["", "分析任务已取消 Ingest job cancelled, the user was deleted."]
+        return "\n".join(lines)
+
+    async def aget_answer(self, question):
+        # Async generator: yields (answer, chat history, sources, generated
+        # question) as the answer streams in, the last item is the complete result
+        if not self.process_status:
             error_msg = "请先上传并分析文件 Please upload and process a file first."
-            return error_msg, error_msg, error_msg, error_msg
+            yield error_msg, error_msg, error_msg, error_msg
+            return
+        partial_answer = ""
+        source_documents = ""
+        generated_question = ""
+        async for event in astream_qa_chain(
+            self.qa, question, self.userid, self.corpus_version
+        ):
+            if "token" in event:
+                partial_answer += event["token"]
+                yield (
+                    partial_answer,
+                    self.chat_history_printout,
+                    source_documents,
+                    generated_question,
+                )
+            elif "answer" in event:
+                result = event
+            else:
+                # Retrieval finished, show sources before generation starts
+                source_documents = prettify_source_documents(event)
+                generated_question = event["generated_question"]
+                # The history keeps its earlier turns until the answer is complete
+                yield (
+                    partial_answer,
+                    self.chat_history_printout,
+                    source_documents,
+                    generated_question,
+                )
+        logger.info(result["answer"])
+        self.chat_history_printout += prettify_chat_turn(question, result["answer"])
+        yield (
+            result["answer"],
+            self.chat_history_printout,
+            prettify_source_documents(result),
+            result["generated_question"],
+        )
 
 
 class GradioApp:
     def __init__(self):
         self.ui = gr.Blocks()
-        self.ai_assistant = None
 
     def launch(self):
         with self.ui:
             gr.Markdown("# AI 论文小助手")
+            # Each browser session gets its own assistant (user ID, QA chain, memory)
+            ai_assistant = gr.State()
             userid = gr.Textbox(label="用户ID")
             pdf_upload = gr.Files(label="上传PDF文件")
             btn_process_and_load_user_profile = gr.Button(
@@ -225,12 +359,12 @@ class GradioApp:
 
             btn_process_and_load_user_profile.click(
                 fn=self.process_file_and_load_user_profile,
-                inputs=[pdf_upload, userid],
-                outputs=[process_message],
+                inputs=[pdf_upload, userid, ai_assistant],
+                outputs=[process_message, ai_assistant],
             )
             btn_ask.click(
                 fn=self.get_answer,
-                inputs=[current_question],
+                inputs=[current_question, ai_assistant],
                 outputs=[
                     current_answer,
                     chat_hitsory,
@@ -240,6 +374,7 @@ class GradioApp:
             )
             btn_clear.click(
                 fn=self.clear_conv_hsitory,
+                inputs=[ai_assistant],
                 outputs=[
                     current_question,
                     generated_question,
@@ -251,45 +386,77 @@ class GradioApp:
             btn_delete_user.click(
                 fn=self.delete_user, inputs=[userid], outputs=[process_message]
             )
+            self.ui.load(
+                fn=self.check_ingest_job,
+                inputs=[ai_assistant],
+                outputs=[process_message],
+                every=ingest_progress_interval,
+            )
 
         gr.close_all()
+        # Handlers run on a bounded worker pool; requests beyond the queue
+        # depth are turned away instead of piling up behind slow ingests
+        # (Gradio 4 renamed concurrency_count to default_concurrency_limit)
+        if "default_concurrency_limit" in inspect.signature(self.ui.queue).parameters:
+            self.ui.queue(default_concurrency_limit=gradio_concurrency, max_size=gradio_max_queue)
+        else:
+            self.ui.queue(concurrency_count=gradio_concurrency, max_size=gradio_max_queue)
+        start_metrics_server()
+        if ingest_jobs.has_pending():
+            # Jobs left over from the previous run
+            ensure_ingest_workers()
         self.ui.launch(share=False, server_port=7878)
 
 
     def verify_pdf_files(self, files):
+        # Only the structural checks, which read a few KB per file; the text
+        # is extracted by the ingest job, which reports files it cannot read
         invalid_files = []
         for file in files:
             try:
-                pypdf.PdfReader(file.name)
-            except pypdf.errors.PdfReadError:
+                check_pdf_structure(file.name)
+            except (InvalidPDFError, OSError) as e:
+                logger.info(f"Invalid PDF {file.name}: {e}")
                 invalid_files.append(os.path.basename(file.name))
         if invalid_files:
             return f"The following PDF files could not be properly loaded: \n\n{', '.join(invalid_files)}"
         else:
             return None
 
-    def process_file_and_load_user_profile(self, files, userid):
+    async def process_file_and_load_user_profile(self, files, userid, ai_assistant):
+        # Handlers are coroutines: while one user waits on OpenAI, the same
+        # worker serves the others
         if files is not None:
-            invalid_files_message = self.verify_pdf_files(files)
+            invalid_files_message = await asyncio.to_thread(self.verify_pdf_files, files)
             if invalid_files_message:
-                return invalid_files_message
-        self.ai_assistant = AIAssistant(userid)
-        process_message = self.ai_assistant.process_file_and_load_user_profile(files)
-        return process_message
+                return invalid_files_message, ai_assistant
+        ai_assistant = AIAssistant(userid)
+        process_message = await ai_assistant.aprocess_file_and_load_user_profile(files)
+        return process_message, ai_assistant
 
-    def get_answer(self, question):
-        (
+    @staticmethod
+    def check_ingest_job(ai_assistant):
+        message = ai_assistant.check_ingest_job() if ai_assistant is not None else None
+        return gr.update() if message is None else message
+
+    async def get_answer(self, question, ai_assistant):
+        if ai_assistant is None:
+            error_msg = "请先上传并分析文件 Please upload and process a file first."
+            yield error_msg, error_msg, error_msg, error_msg
+            return
+        async for (
             current_answer,
             chat_hitsory,
             source_documents,
             generated_question,
-        ) = self.ai_assistant.get_answer(question)
-        return current_answer, chat_hitsory, source_documents, generated_question
+        ) in ai_assistant.aget_answer(question):
+            yield current_answer, chat_hitsory, source_documents, generated_question
 
-    def clear_conv_hsitory(self):
+    def clear_conv_hsitory(self, ai_assistant):
         try:
-            vectordb = load_user_db(self.ai_assistant.userid)
-            self.ai_assistant.qa = create_qa_chain(vectordb)
+            vectordb = load_user_db(ai_assistant.userid)
+            ai_assistant.qa = create_user_qa_chain(ai_assistant.userid, vectordb)
+            ai_assistant.chat_history_printout = CHAT_HISTORY_HEADER
         except:
             pass
         current_question = ""
@@ -308,14 +475,13 @@ class GradioApp:
     @staticmethod
     def delete_user(userid):
         try:
-            if userid != "":
-                if os.path.exists(f"{user_files_directory}/{userid}"):
-                    shutil.rmtree(f"{user_files_directory}/{userid}")
-                    process_message = f"用户 {userid} 已删除 -- user {userid} deleted "
-                else:
-                    process_message = f"用户 {userid} 不存在 -- user {userid} does not exist"
-            else:
+            if userid == "":
                 process_message = "没有输入用户名 -- No user-id entered"
+            elif not os.path.exists(f"{user_files_directory}/{userid}"):
+                process_message = f"用户 {userid} 不存在 -- user {userid} does not exist"
+            else:
+                with get_user_lock(userid):
+                    process_message = GradioApp._delete_user(userid)
         except:
             process_message = (
                 f"用户 {userid} 是当前活跃用户， 无法删除 -- "
@@ -323,7 +489,31 @@ class GradioApp:
             )
         return process_message
 
+    @staticmethod
+    def _delete_user(userid):
+        # Holds the user's lock, so no session of this process queues a job
+        # meanwhile. A job left running by a dead worker is requeued first,
+        # so it can be cancelled instead of blocking the delete.
+        if _ingest_worker_processes:
+            ensure_ingest_workers()
+        else:
+            ingest_jobs.requeue_abandoned()
+        if not ingest_jobs.cancel_user(userid):
+            return (
+                f"用户 {userid} 的文件正在分析， 无法删除 -- "
+                f"files of user {userid} are being ingested, cannot be deleted"
+            )
+        invalidate_user_db(userid)
+        answer_cache.invalidate(userid)
+        file_hashes = [entry["sha256"] for entry in load_user_manifest(userid).files.values()]
+        shutil.rmtree(f"{user_files_directory}/{userid}")
+        # Shared copies are freed once no other user references them
+        release_user_files(userid, file_hashes)
+        return f"用户 {userid} 已删除 -- user {userid} deleted "
+
 
 if __name__ == "__main__":
+    # Exit through atexit on SIGTERM too, so the ingest workers are stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app = GradioApp()
     app.launch()
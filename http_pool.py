@@ -0,0 +1,46 @@
+# http_pool.py
+
+import asyncio
+import os
+
+import aiohttp
+import openai
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+http_pool_size = int(os.getenv("HTTP_POOL_SIZE", 32))
+http_pool_per_host = int(os.getenv("HTTP_POOL_PER_HOST", 0))
+
+# One aiohttp session per event loop; a session cannot be shared across loops
+_sessions = {}
+
+
+def get_http_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=http_pool_size, limit_per_host=http_pool_per_host
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+        logger.info(f"Opened HTTP connection pool with {http_pool_size} connections")
+    return session
+
+
+def use_shared_openai_session():
+    # openai 0.x reads openai.aiosession (a ContextVar) on every async call,
+    # so embeddings and chat completions in this task reuse the pooled
+    # keep-alive connections instead of opening a session per request
+    session = get_http_session()
+    openai.aiosession.set(session)
+    return session
+
+
+async def close_http_sessions():
+    for loop, session in list(_sessions.items()):
+        if loop is asyncio.get_running_loop() and not session.closed:
+            await session.close()
+            del _sessions[loop]
@@ -0,0 +1,491 @@
+# index_service.py
+#
+# Index tier shared by several Gradio front-ends: a supervisor process keeps
+# n shard processes running, each one owns the vector stores of the users
+# hashed to it and keeps them warm. Front-ends use VECTOR_BACKEND=remote,
+# embed locally and only send vectors; shard i listens on port + i.
+# INDEX_SERVICE_SHARDS is the shard count on both sides. Clients check it
+# against each shard's /info, and shards refuse stores hashed elsewhere.
+#
+#   python index_service.py --port 8700 --shards 4
+
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+
+from numpy_vectorstore import maximal_marginal_relevance, normalize
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+index_service_host = os.environ.get("INDEX_SERVICE_HOST", "127.0.0.1")
+index_service_port = int(os.environ.get("INDEX_SERVICE_PORT", 8700))
+index_service_shards = int(os.environ.get("INDEX_SERVICE_SHARDS", 2))
+index_service_pool_size = int(os.environ.get("INDEX_SERVICE_POOL_SIZE", 8))
+index_service_timeout = float(os.environ.get("INDEX_SERVICE_TIMEOUT", 30))
+# Vector store the shards use on disk
+index_service_backend = os.environ.get("INDEX_SERVICE_BACKEND", "chroma")
+
+
+class IndexServiceError(RuntimeError):
+    pass
+
+
+def shard_of(store, n_shards):
+    # Stable across processes and machines, unlike hash()
+    return int(hashlib.sha256(store.encode("utf-8")).hexdigest(), 16) % n_shards
+
+
+def _encode_vectors(vectors):
+    # float32 matrix as base64, a fraction of the size of a JSON float list
+    if vectors is None:
+        return None
+    array = np.asarray(vectors, dtype=np.float32)
+    return {"shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode()}
+
+
+def _decode_vectors(payload):
+    if payload is None:
+        return None
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(
+        payload["shape"]
+    )
+
+
+def _encode_documents(documents):
+    return [[doc.page_content, doc.metadata] for doc in documents]
+
+
+def _decode_documents(payload):
+    return [Document(page_content=text, metadata=metadata or {}) for text, metadata in payload]
+
+
+def run_index_shard(host, port, backend, shard=0, n_shards=1):
+    # Shard process main loop; utils is imported here so that front-ends
+    # importing the client do not pull in the server side
+    from metrics import stage_metrics, track
+    from retrieval import dense_candidates
+    from utils import (
+        VectorDBCache,
+        delete_chunks,
+        get_chunk_documents,
+        get_chunk_metadatas,
+        open_vectordb,
+        upsert_embeddings,
+        vectordb_cache_idle_seconds,
+        vectordb_cache_max_open,
+    )
+
+    # Handles are keyed by (store directory, backend)
+    stores = VectorDBCache(vectordb_cache_max_open, vectordb_cache_idle_seconds)
+
+    def open_store(request):
+        directory = request["store"]
+        return stores.get((directory, backend), lambda: open_vectordb(directory, backend))
+
+    def add(request):
+        documents = _decode_documents(request["documents"])
+        embeddings = _decode_vectors(request["embeddings"]).tolist()
+        upsert_embeddings(open_store(request), request["ids"], documents, embeddings)
+        return {"ids": request["ids"]}
+
+    def delete(request):
+        delete_chunks(open_store(request), request["ids"])
+        return {}
+
+    def get(request):
+        if request.get("documents", True):
+            ids, documents = get_chunk_documents(open_store(request))
+            return {"ids": ids, "documents": _encode_documents(documents)}
+        ids, metadatas = get_chunk_metadatas(open_store(request))
+        return {"ids": ids, "metadatas": metadatas}
+
+    def query(request):
+        ids, documents, similarities, vectors = dense_candidates(
+            open_store(request), request["embedding"], request["k"]
+        )
+        return {
+            "ids": list(ids),
+            "documents": _encode_documents(documents),
+            "similarities": _encode_vectors(similarities),
+            "vectors": _encode_vectors(vectors) if request.get("vectors", True) else None,
+        }
+
+    def invalidate(request):
+        stores.invalidate(request["store"])
+        return {}
+
+    def info(request):
+        return {"shard": shard, "n_shards": n_shards, "backend": backend}
+
+    handlers = {
+        "info": info,
+        "add": add,
+        "delete": delete,
+        "get": get,
+        "query": query,
+        "invalidate": invalidate,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 so clients keep their pooled connections open
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = stage_metrics.prometheus_text().encode("utf-8")
+            self._reply(200, body, "text/plain; version=0.0.4; charset=utf-8")
+
+        def do_POST(self):
+            method = self.path.strip("/")
+            handler = handlers.get(method)
+            if handler is None:
+                self.send_error(404)
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            except (TypeError, ValueError) as e:
+                # Part of the body may be unread, so the connection is not reused
+                self.close_connection = True
+                body = json.dumps({"error": f"Malformed request: {e}"}).encode("utf-8")
+                self._reply(400, body)
+                return
+            owner = shard_of(request["store"], n_shards) if "store" in request else shard
+            if owner != shard:
+                # The client uses another shard count; serving it would
+                # split a user's chunks across shards
+                error = f"Store belongs to shard {owner} of {n_shards}, not shard {shard}"
+                self._reply(409, json.dumps({"error": error}).encode("utf-8"))
+                return
+            try:
+                with track(f"index_{method}"):
+                    status, response = 200, handler(request)
+            except Exception as e:
+                logger.exception(f"Index request {method} failed")
+                status, response = 500, {"error": f"{e.__class__.__name__}: {e}"}
+            self._reply(status, json.dumps(response, ensure_ascii=False).encode("utf-8"))
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    logger.info(
+        f"Index shard {shard} of {n_shards} serving {backend} stores on http://{host}:{port}"
+    )
+    server.serve_forever()
+
+
+def run_index_service(host=None, port=None, n_shards=None, backend=None):
+    # Supervisor: starts the shards and restarts any that die. Spawned, not
+    # forked, so every shard opens its stores from a clean interpreter.
+    host = host or index_service_host
+    port = port or index_service_port
+    n_shards = n_shards or index_service_shards
+    backend = backend or index_service_backend
+    context = multiprocessing.get_context("spawn")
+    shards = {}
+
+    def start(i):
+        shards[i] = context.Process(
+            target=run_index_shard,
+            args=(host, port + i, backend, i, n_shards),
+            name=f"index-shard-{i}",
+        )
+        shards[i].start()
+
+    # Stopping the supervisor stops its shards
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    for i in range(n_shards):
+        start(i)
+    try:
+        while True:
+            time.sleep(1)
+            for i, shard in list(shards.items()):
+                if not shard.is_alive():
+                    logger.warning(f"Index shard {i} exited with {shard.exitcode}, restarting")
+                    start(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for shard in shards.values():
+            shard.terminate()
+        for shard in shards.values():
+            shard.join()
+
+
+class IndexServiceClient:
+    # Thread-safe client with a pool of keep-alive connections per shard.
+    # A store is assigned to a shard by a stable hash of its directory, so
+    # every front-end sends a given user to the same warm shard. Each shard's
+    # index and shard count are checked once, before its first request.
+    def __init__(self, host, port, n_shards, pool_size=8, timeout=30):
+        self.host = host
+        self.port = port
+        self.n_shards = n_shards
+        self.timeout = timeout
+        self._pools = [queue.LifoQueue(maxsize=pool_size) for _ in range(n_shards)]
+        self._checked = [False] * n_shards
+
+    def shard_of(self, store):
+        return shard_of(store, self.n_shards)
+
+    def _check_shard(self, shard):
+        info = self._request(shard, "info", {})
+        if (info["shard"], info["n_shards"]) != (shard, self.n_shards):
+            raise IndexServiceError(
+                f"Port {self.port + shard} serves shard {info['shard']} of "
+                f"{info['n_shards']}, expected shard {shard} of {self.n_shards}; "
+                "INDEX_SERVICE_SHARDS differs between the client and the service"
+            )
+        self._checked[shard] = True
+
+    def call(self, store, method, **params):
+        shard = self.shard_of(store)
+        if not self._checked[shard]:
+            self._check_shard(shard)
+        return self._request(shard, method, dict(params, store=store))
+
+    def _request(self, shard, method, params):
+        pool = self._pools[shard]
+        body = json.dumps(params, ensure_ascii=False).encode("utf-8")
+        while True:
+            try:
+                connection, reused = pool.get_nowait(), True
+            except queue.Empty:
+                connection = http.client.HTTPConnection(
+                    self.host, self.port + shard, timeout=self.timeout
+                )
+                reused = False
+            try:
+                connection.request(
+                    "POST", f"/{method}", body, {"Content-Type": "application/json"}
+                )
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                # A pooled connection may have been closed by a restarted
+                # shard; every request is safe to send again
+                if reused:
+                    continue
+                raise IndexServiceError(f"Index shard {shard} unreachable: {e}") from e
+            try:
+                pool.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+            if response.status != 200:
+                error = f"HTTP {response.status}"
+                # Errors raised before our handler runs come back as HTML
+                if response.getheader("Content-Type", "").startswith("application/json"):
+                    error = json.loads(data).get("error", error)
+                raise IndexServiceError(error)
+            return json.loads(data)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_index_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = IndexServiceClient(
+                index_service_host,
+                index_service_port,
+                index_service_shards,
+                pool_size=index_service_pool_size,
+                timeout=index_service_timeout,
+            )
+    return _client
+
+
+class RemoteVectorStore(VectorStore):
+    # Client backend for one store on the index service. Same interface as
+    # NumpyVectorStore; queries are embedded here and sent as vectors.
+    def __init__(
+        self,
+        persist_directory: str,
+        embedding_function: Embeddings,
+        client: Optional[IndexServiceClient] = None,
+    ):
+        # Front-ends and shards share the file system, the absolute
+        # directory names the store on both sides
+        self.persist_directory = os.path.abspath(persist_directory)
+        self._embedding_function = embedding_function
+        self._client = client or get_index_client()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    def _call(self, method, **params):
+        return self._client.call(self.persist_directory, method, **params)
+
+    def invalidate(self):
+        # Makes the shard drop its handle, before the directory is removed
+        self._call("invalidate")
+
+    def add_texts(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(
+            texts, self._embedding_function.embed_documents(texts), metadatas, ids
+        )
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        documents = [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)
+        ]
+        return self._call(
+            "add",
+            ids=ids,
+            documents=_encode_documents(documents),
+            embeddings=_encode_vectors(embeddings),
+        )["ids"]
+
+    def delete(self, ids: List[str]):
+        self._call("delete", ids=list(ids))
+
+    def get_documents(self):
+        result = self._call("get", documents=True)
+        return result["ids"], _decode_documents(result["documents"])
+
+    def get_metadatas(self):
+        result = self._call("get", documents=False)
+        return result["ids"], result["metadatas"]
+
+    def search_by_vector_with_ids(self, embedding, k=4, vectors=True):
+        # Returns (ids, documents, cosine similarities, unit vectors) of the top k
+        result = self._call(
+            "query", embedding=list(map(float, embedding)), k=k, vectors=vectors
+        )
+        return (
+            result["ids"],
+            _decode_documents(result["documents"]),
+            _decode_vectors(result["similarities"]),
+            _decode_vectors(result["vectors"]),
+        )
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        _, documents, similarities, _ = self.search_by_vector_with_ids(
+            embedding, k, vectors=False
+        )
+        return list(zip(documents, similarities.tolist()))
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any):
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k)
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4, **kwargs: Any):
+        # Cosine similarity in [-1, 1] mapped to a relevance score in [0, 1]
+        return [
+            (doc, (score + 1) / 2)
+            for doc, score in self.similarity_search_with_score(query, k)
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        _, documents, _, vectors = self.search_by_vector_with_ids(embedding, fetch_k)
+        if not documents:
+            return []
+        selected = maximal_marginal_relevance(
+            normalize(embedding), vectors, k=k, lambda_mult=lambda_mult
+        )
+        return [documents[i] for i in selected]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(embedding, k, fetch_k, lambda_mult)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        persist_directory: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "RemoteVectorStore":
+        vectordb = cls(persist_directory=persist_directory, embedding_function=embedding)
+        vectordb.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vectordb
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded vector index service")
+    parser.add_argument("--host", default=index_service_host)
+    parser.add_argument("--port", type=int, default=index_service_port)
+    parser.add_argument("--shards", type=int, default=index_service_shards)
+    parser.add_argument("--backend", default=index_service_backend, choices=["chroma", "numpy"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_index_service(args.host, args.port, args.shards, args.backend)
+
+
+if __name__ == "__main__":
+    main()
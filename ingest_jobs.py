@@ -0,0 +1,288 @@
+# ingest_jobs.py
+
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestJobQueue:
+    # SQLite-backed queue shared by the app process and the ingest workers.
+    # A job is the list of files saved by one upload; each file's stage is
+    # updated as it moves through the pipeline, so the UI can poll progress
+    # and a restarted worker only redoes the files that were not indexed.
+    # Files the worker could not extract end in stage "invalid".
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, "
+            "userid TEXT NOT NULL, status TEXT NOT NULL, worker_pid INTEGER, "
+            "error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files (job_id TEXT NOT NULL, "
+            "position INTEGER NOT NULL, file TEXT NOT NULL, stage TEXT NOT NULL, "
+            "info TEXT NOT NULL DEFAULT '{}', PRIMARY KEY (job_id, position))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created)")
+
+    def enqueue(self, userid, file_list):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, userid, status, created, updated) "
+                "VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, userid, now, now),
+            )
+            self._conn.executemany(
+                "INSERT INTO job_files (job_id, position, file, stage) "
+                "VALUES (?, ?, ?, 'queued')",
+                [(job_id, i, file) for i, file in enumerate(file_list)],
+            )
+            self._conn.execute("COMMIT")
+        logger.info(f"Queued ingest job {job_id} for user {userid}: {len(file_list)} files")
+        return job_id
+
+    def requeue_abandoned(self):
+        # Jobs left running by a worker that died are picked up again
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, worker_pid FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            abandoned = [job_id for job_id, pid in rows if not pid or not _pid_alive(pid)]
+            for job_id in abandoned:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker_pid = NULL, updated = ? "
+                    "WHERE job_id = ? AND status = 'running'",
+                    (time.time(), job_id),
+                )
+        for job_id in abandoned:
+            logger.info(f"Requeued abandoned ingest job {job_id}")
+        return abandoned
+
+    def claim(self, worker_pid):
+        # Oldest queued job of a user with no running job, so one user's
+        # uploads are never ingested by two workers at once.
+        # Returns (job_id, userid, files not yet indexed) or None.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT job_id, userid FROM jobs WHERE status = 'queued' AND userid "
+                    "NOT IN (SELECT userid FROM jobs WHERE status = 'running') "
+                    "ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, userid = row
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_pid = ?, updated = ? "
+                    "WHERE job_id = ?",
+                    (worker_pid, time.time(), job_id),
+                )
+                files = [
+                    file
+                    for (file,) in self._conn.execute(
+                        "SELECT file FROM job_files WHERE job_id = ? "
+                        "AND stage NOT IN ('indexed', 'invalid') ORDER BY position",
+                        (job_id,),
+                    )
+                ]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id, userid, files
+
+    def update_file(self, job_id, file, stage, **info):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT info FROM job_files WHERE job_id = ? AND file = ?", (job_id, file)
+            ).fetchone()
+            if row is None:
+                return
+            merged = dict(json.loads(row[0]), **info)
+            self._conn.execute(
+                "UPDATE job_files SET stage = ?, info = ? WHERE job_id = ? AND file = ?",
+                (stage, json.dumps(merged), job_id, file),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET updated = ? WHERE job_id = ?", (time.time(), job_id)
+            )
+
+    def finish(self, job_id, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, worker_pid = NULL, updated = ? "
+                "WHERE job_id = ?",
+                ("failed" if error else "done", error, time.time(), job_id),
+            )
+
+    def cancel_user(self, userid):
+        # Before a user is deleted: queued jobs would recreate the user's
+        # directory. Checked and cancelled in one write transaction, so no
+        # worker can claim a job in between. Returns False, cancelling
+        # nothing, while one of the user's jobs is running.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                running = self._conn.execute(
+                    "SELECT 1 FROM jobs WHERE userid = ? AND status = 'running'", (userid,)
+                ).fetchone()
+                if running is None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'cancelled', updated = ? "
+                        "WHERE userid = ? AND status = 'queued'",
+                        (time.time(), userid),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return running is None
+
+    def has_pending(self):
+        # Queued jobs, or running ones whose worker may have died
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE status IN ('queued', 'running') LIMIT 1"
+            ).fetchone()
+        return row is not None
+
+    def active_job(self, userid):
+        # A queued or running job of the user, if any
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE userid = ? AND status IN ('queued', 'running')",
+                (userid,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, userid, status, error FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            files = self._conn.execute(
+                "SELECT file, stage, info FROM job_files WHERE job_id = ? ORDER BY position",
+                (job_id,),
+            ).fetchall()
+        job_id, userid, status, error = row
+        return {
+            "job_id": job_id,
+            "userid": userid,
+            "status": status,
+            "error": error,
+            "files": [
+                dict(json.loads(info), file=file, stage=stage) for file, stage, info in files
+            ],
+        }
+
+
+def run_ingest_worker(path, poll_interval=1.0, metrics_port=0):
+    # Worker process main loop; utils is imported here so the app process
+    # can use the queue without pulling in the ingest stack twice
+    from http_pool import close_http_sessions
+    from metrics import start_metrics_server
+    from utils import aingest_user_files
+
+    async def ingest(file_list, userid, progress):
+        # Each job runs in a fresh event loop, its pooled session goes with it
+        try:
+            return await aingest_user_files(file_list, userid, progress)
+        finally:
+            await close_http_sessions()
+
+    # Terminating the worker unwinds it, so its extraction pool is stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    start_metrics_server(metrics_port)
+    jobs = IngestJobQueue(path)
+    pid = os.getpid()
+    parent = multiprocessing.parent_process()
+    logger.info(f"Ingest worker {pid} started")
+    while True:
+        # A killed app cannot stop its workers; they exit on their own
+        # rather than linger next to the workers of the next start
+        if parent is not None and not parent.is_alive():
+            logger.info(f"Ingest worker {pid} exiting, the app has stopped")
+            return
+        jobs.requeue_abandoned()
+        claimed = jobs.claim(pid)
+        if claimed is None:
+            time.sleep(poll_interval)
+            continue
+        job_id, userid, file_list = claimed
+        logger.info(f"Worker {pid} running ingest job {job_id}: {len(file_list)} files")
+
+        def progress(file, stage, **info):
+            jobs.update_file(job_id, file, stage, **info)
+
+        try:
+            asyncio.run(ingest(file_list, userid, progress))
+        except Exception as e:
+            logger.exception(f"Ingest job {job_id} failed")
+            jobs.finish(job_id, error=f"{e.__class__.__name__}: {e}")
+        else:
+            jobs.finish(job_id)
+
+
+def start_ingest_worker(path, index, metrics_port=0):
+    # Spawned rather than forked: the app process runs threads. The workers
+    # are not daemonic because they start their own PDF extraction pools.
+    # With a metrics port, worker i serves its metrics on metrics_port + i + 1.
+    context = multiprocessing.get_context("spawn")
+    worker = context.Process(
+        target=run_ingest_worker,
+        args=(path, 1.0, metrics_port + index + 1 if metrics_port else 0),
+        name=f"ingest-worker-{index}",
+    )
+    worker.start()
+    return worker
+
+
+def start_ingest_workers(path, n_workers, metrics_port=0):
+    return [start_ingest_worker(path, i, metrics_port) for i in range(n_workers)]
+
+
+def stop_ingest_workers(workers, timeout=10):
+    # A job interrupted here is requeued by the next start
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+    for worker in workers:
+        worker.join(timeout)
+        if worker.is_alive():
+            worker.kill()
+            worker.join()
@@ -0,0 +1,114 @@
+# manifest.py
+
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_ids(file_hash, n_chunks, name):
+    # Chunk IDs are derived from the file content, so re-adding an unchanged
+    # file upserts the same rows instead of duplicating them. The file name
+    # is part of the ID: two names holding the same content must not own
+    # the same rows, or deleting one would delete the other's chunks.
+    name_digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:8]
+    return [f"{file_hash[:16]}-{name_digest}-{i:05d}" for i in range(n_chunks)]
+
+
+class UserManifest:
+    # Per-user record of every ingested file, stored as JSON next to the vector store:
+    # {"files": {basename: {"sha256", "pages", "chunk_ids", "embedding_model"}}}
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def find_by_hash(self, file_hash):
+        for name, entry in self.files.items():
+            if entry["sha256"] == file_hash:
+                return name
+        return None
+
+    def version(self):
+        # Changes whenever a file is added, replaced, removed or re-embedded
+        digest = hashlib.sha256()
+        for name in sorted(self.files):
+            entry = self.files[name]
+            line = f"{name}\x00{entry['sha256']}\x00{entry['embedding_model']}\n"
+            digest.update(line.encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def record(self, name, file_hash, pages, chunk_ids, embedding_model):
+        self.files[name] = {
+            "sha256": file_hash,
+            "pages": pages,
+            "chunk_ids": list(chunk_ids),
+            "embedding_model": embedding_model,
+        }
+
+    def remove(self, name):
+        return self.files.pop(name, None)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": MANIFEST_VERSION, "files": self.files},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def rebuild_from_chunks(cls, path, ids, metadatas, embedding_model, docs_dir=None):
+        # Recovers the manifest from chunk metadata already stored in the
+        # vector store, without re-parsing or re-embedding anything
+        manifest = cls.__new__(cls)
+        manifest.path = path
+        manifest.files = {}
+
+        chunk_ids = defaultdict(list)
+        metadata_by_name = {}
+        for chunk_id, metadata in zip(ids, metadatas):
+            name = os.path.basename(metadata["source"])
+            chunk_ids[name].append(chunk_id)
+            metadata_by_name[name] = metadata
+
+        for name, ids in chunk_ids.items():
+            metadata = metadata_by_name[name]
+            file_hash = metadata.get("file_hash")
+            if file_hash is None and docs_dir and os.path.exists(os.path.join(docs_dir, name)):
+                # Chunks ingested before the manifest existed carry no hash
+                file_hash = file_sha256(os.path.join(docs_dir, name))
+            manifest.record(
+                name,
+                file_hash or "",
+                metadata.get("total_pages", 0),
+                sorted(ids),
+                embedding_model,
+            )
+        logger.info(f"Rebuilt manifest with {len(manifest.files)} files from {path}")
+        return manifest
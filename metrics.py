@@ -0,0 +1,204 @@
+# metrics.py
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+metrics_trace_path = os.environ.get("METRICS_TRACE_PATH", "")
+metrics_port = int(os.environ.get("METRICS_PORT", 0))
+
+# Upper bounds of the stage duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Per-stage quantities that are summed into counters
+COUNTED_VALUES = ("tokens", "chunks", "pages")
+
+
+def peak_rss_bytes():
+    # Peak resident set size of this process so far (ru_maxrss is KiB on Linux)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics:
+    # Per-stage wall time histogram, counters for tokens / chunks / pages and
+    # the process peak RSS seen at the end of the stage. Every observation is
+    # also appended to a JSONL trace file when one is configured.
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._cache_sources = []
+
+    def add_cache_source(self, source):
+        # source() returns {cache name: stats dict} as the caches' stats()
+        # report them; it is called on every scrape
+        self._cache_sources.append(source)
+
+    def cache_snapshot(self):
+        caches = {}
+        for source in self._cache_sources:
+            for name, stats in source().items():
+                if not stats:
+                    continue
+                hits = stats.get("hits", stats.get("exact_hits", 0) + stats.get("similar_hits", 0))
+                misses = stats.get("misses", 0)
+                caches[name] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                    "entries": stats.get("entries", stats.get("files", 0)),
+                }
+        return caches
+
+    def observe(self, stage, seconds, error=False, **values):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "buckets": [0] * len(DURATION_BUCKETS),
+                    "peak_rss_bytes": 0,
+                    **{name: 0 for name in COUNTED_VALUES},
+                }
+            entry["count"] += 1
+            entry["errors"] += int(error)
+            entry["seconds"] += seconds
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+            for name in COUNTED_VALUES:
+                entry[name] += values.get(name) or 0
+            entry["peak_rss_bytes"] = max(
+                entry["peak_rss_bytes"], values.get("peak_rss_bytes") or 0
+            )
+            if self.trace_path:
+                record = {
+                    "ts": time.time(),
+                    "pid": os.getpid(),
+                    "stage": stage,
+                    "seconds": round(seconds, 6),
+                    "error": error,
+                    **values,
+                }
+                with open(self.trace_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def track(self, stage, **values):
+        # Times the block; the block may add counts to the yielded dict,
+        # e.g. span["chunks"] = len(splits)
+        span = dict(values)
+        started = time.perf_counter()
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            span.setdefault("peak_rss_bytes", peak_rss_bytes())
+            self.observe(stage, time.perf_counter() - started, error=error, **span)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: dict(entry, buckets=list(entry["buckets"]))
+                for stage, entry in self._stages.items()
+            }
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP chatpdf_stage_seconds Wall time per pipeline stage.",
+            "# TYPE chatpdf_stage_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        for stage, entry in sorted(snapshot.items()):
+            for bound, count in zip(DURATION_BUCKETS, entry["buckets"]):
+                lines.append(
+                    f'chatpdf_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'chatpdf_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}'
+            )
+            lines.append(f'chatpdf_stage_seconds_sum{{stage="{stage}"}} {entry["seconds"]}')
+            lines.append(f'chatpdf_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        lines += [
+            "# HELP chatpdf_stage_errors_total Stage runs that raised.",
+            "# TYPE chatpdf_stage_errors_total counter",
+        ]
+        for stage, entry in sorted(snapshot.items()):
+            lines.append(f'chatpdf_stage_errors_total{{stage="{stage}"}} {entry["errors"]}')
+        for name in COUNTED_VALUES:
+            lines += [
+                f"# HELP chatpdf_stage_{name}_total {name.capitalize()} processed per stage.",
+                f"# TYPE chatpdf_stage_{name}_total counter",
+            ]
+            for stage, entry in sorted(snapshot.items()):
+                if entry[name]:
+                    lines.append(f'chatpdf_stage_{name}_total{{stage="{stage}"}} {entry[name]}')
+        lines += [
+            "# HELP chatpdf_stage_peak_rss_bytes Process peak RSS seen at the end of a stage.",
+            "# TYPE chatpdf_stage_peak_rss_bytes gauge",
+        ]
+        for stage, entry in sorted(snapshot.items()):
+            lines.append(
+                f'chatpdf_stage_peak_rss_bytes{{stage="{stage}"}} {entry["peak_rss_bytes"]}'
+            )
+        caches = self.cache_snapshot()
+        for name, kind, help_text in (
+            ("hits", "counter", "Cache lookups served from the cache."),
+            ("misses", "counter", "Cache lookups that missed."),
+            ("hit_rate", "gauge", "Hits over lookups since the process started."),
+            ("entries", "gauge", "Entries currently held."),
+        ):
+            metric = f"chatpdf_cache_{name}_total" if kind == "counter" else f"chatpdf_cache_{name}"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            for cache, entry in sorted(caches.items()):
+                lines.append(f'{metric}{{cache="{cache}"}} {entry[name]}')
+        return "\n".join(lines) + "\n"
+
+
+stage_metrics = StageMetrics(metrics_trace_path or None)
+track = stage_metrics.track
+observe = stage_metrics.observe
+add_cache_source = stage_metrics.add_cache_source
+
+
+def start_metrics_server(port=None, metrics=None):
+    # Serves GET /metrics in the Prometheus text format from a daemon thread.
+    # Each process serves its own stages, so ingest workers get their own port.
+    port = metrics_port if port is None else port
+    if not port:
+        return None
+    metrics = metrics or stage_metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    return server
@@ -0,0 +1,344 @@
+# numpy_vectorstore.py
+
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rewrite the vector file once this share of rows are tombstones
+_COMPACT_RATIO = 0.25
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def maximal_marginal_relevance(query, candidates, k=4, lambda_mult=0.5):
+    # query (d,) and candidates (n, d) must be L2-normalised.
+    # One batched (n, n) similarity matrix is computed up front, each
+    # selection step is then a vectorised max/argmax over it.
+    n = candidates.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    similarity_to_query = candidates @ query
+    similarity_between = candidates @ candidates.T
+    selected = [int(np.argmax(similarity_to_query))]
+    max_similarity_to_selected = similarity_between[selected[0]].copy()
+    for _ in range(min(k, n) - 1):
+        scores = (
+            lambda_mult * similarity_to_query
+            - (1 - lambda_mult) * max_similarity_to_selected
+        )
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(
+            max_similarity_to_selected,
+            similarity_between[best],
+            out=max_similarity_to_selected,
+        )
+    return selected
+
+
+class NumpyVectorStore(VectorStore):
+    # Compact local vector index for per-user corpora of a few thousand chunks.
+    # Unit-normalised float32 vectors live in a memory-mapped file
+    # (vectors.f32), texts and metadata in a SQLite sidecar (chunks.sqlite3).
+    # Row i of the matrix is row i of the sidecar; deletes are tombstones
+    # until the file is compacted.
+    def __init__(self, persist_directory: str, embedding_function: Embeddings):
+        if not os.path.exists(persist_directory):
+            os.makedirs(persist_directory, exist_ok=True)
+        self.persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self._vectors_path = os.path.join(persist_directory, "vectors.f32")
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, "chunks.sqlite3"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._create_chunks_table("chunks")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        row = self._conn.execute("SELECT value FROM settings WHERE key = 'dim'").fetchone()
+        self._dim = int(row[0]) if row else None
+        self._load()
+
+    def _create_chunks_table(self, name):
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} (row INTEGER PRIMARY KEY, id TEXT NOT NULL, "
+            "text TEXT NOT NULL, metadata TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_id ON {name}(id)")
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    def _load(self):
+        self._n_rows = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        self._alive = np.ones(self._n_rows, dtype=bool)
+        for (row,) in self._conn.execute("SELECT row FROM chunks WHERE deleted = 1"):
+            self._alive[row] = False
+        if self._n_rows and self._dim:
+            self._matrix = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(self._n_rows, self._dim)
+            )
+        else:
+            self._matrix = np.zeros((0, self._dim or 0), dtype=np.float32)
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    def _delete_rows_with_ids(self, ids):
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start : start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows += [
+                row
+                for (row,) in self._conn.execute(
+                    f"SELECT row FROM chunks WHERE deleted = 0 AND id IN ({placeholders})",
+                    batch,
+                )
+            ]
+        if rows:
+            self._conn.executemany(
+                "UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows]
+            )
+            self._alive[rows] = False
+        return len(rows)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(
+            texts, self._embedding_function.embed_documents(texts), metadatas, ids
+        )
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        # add_texts with precomputed vectors, for callers that embed themselves
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = normalize(embeddings)
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._conn.execute(
+                    "INSERT INTO settings (key, value) VALUES ('dim', ?)", (str(self._dim),)
+                )
+            # Same semantics as Chroma upsert: re-adding an ID replaces it
+            self._conn.execute("BEGIN")
+            try:
+                self._delete_rows_with_ids(ids)
+                with open(self._vectors_path, "ab") as f:
+                    # Drop rows written by an add that crashed before committing
+                    f.truncate(self._n_rows * self._dim * 4)
+                    f.write(vectors.tobytes())
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, id, text, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            self._n_rows + i,
+                            chunk_id,
+                            text,
+                            json.dumps(metadata, ensure_ascii=False),
+                        )
+                        for i, (chunk_id, text, metadata) in enumerate(
+                            zip(ids, texts, metadatas)
+                        )
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._load()
+                raise
+            self._load()
+        return ids
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            n_deleted = self._delete_rows_with_ids(list(ids))
+            self._conn.execute("COMMIT")
+            if self._n_rows and (~self._alive).sum() > _COMPACT_RATIO * self._n_rows:
+                self.compact()
+        return n_deleted
+
+    def compact(self):
+        # Rewrites the vector file and sidecar without tombstoned rows
+        with self._lock:
+            alive_rows = np.flatnonzero(self._alive)
+            vectors = np.array(self._matrix[alive_rows]) if len(alive_rows) else None
+            tmp_path = f"{self._vectors_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                if vectors is not None:
+                    f.write(vectors.tobytes())
+            self._conn.execute("BEGIN")
+            self._conn.execute("DROP TABLE IF EXISTS chunks_compacted")
+            self._create_chunks_table("chunks_compacted")
+            self._conn.execute(
+                "INSERT INTO chunks_compacted (row, id, text, metadata) "
+                "SELECT ROW_NUMBER() OVER (ORDER BY row) - 1, id, text, metadata "
+                "FROM chunks WHERE deleted = 0"
+            )
+            self._conn.execute("DROP TABLE chunks")
+            self._conn.execute("ALTER TABLE chunks_compacted RENAME TO chunks")
+            self._conn.execute("DROP INDEX IF EXISTS chunks_compacted_id")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_id ON chunks(id)")
+            self._matrix = None
+            os.replace(tmp_path, self._vectors_path)
+            self._conn.execute("COMMIT")
+            self._load()
+            logger.info(f"Compacted {self.persist_directory} to {self._n_rows} rows")
+
+    def get_metadatas(self) -> Tuple[List[str], List[dict]]:
+        rows = self._conn.execute(
+            "SELECT id, metadata FROM chunks WHERE deleted = 0 ORDER BY row"
+        ).fetchall()
+        return [row[0] for row in rows], [json.loads(row[1]) for row in rows]
+
+    def get_documents(self) -> Tuple[List[str], List[Document]]:
+        rows = self._conn.execute(
+            "SELECT id, text, metadata FROM chunks WHERE deleted = 0 ORDER BY row"
+        ).fetchall()
+        return [row[0] for row in rows], [
+            Document(page_content=row[1], metadata=json.loads(row[2])) for row in rows
+        ]
+
+    def get_vectors(self, rows) -> np.ndarray:
+        return np.asarray(self._matrix[rows])
+
+    def _documents_with_ids(self, rows) -> Tuple[List[str], List[Document]]:
+        if len(rows) == 0:
+            return [], []
+        placeholders = ",".join("?" * len(rows))
+        found = {
+            row: (chunk_id, Document(page_content=text, metadata=json.loads(metadata)))
+            for row, chunk_id, text, metadata in self._conn.execute(
+                f"SELECT row, id, text, metadata FROM chunks WHERE row IN ({placeholders})",
+                [int(row) for row in rows],
+            )
+        }
+        ids, documents = zip(*(found[int(row)] for row in rows))
+        return list(ids), list(documents)
+
+    def _documents(self, rows) -> List[Document]:
+        return self._documents_with_ids(rows)[1]
+
+    def _top_rows(self, query_vector, k) -> Tuple[np.ndarray, np.ndarray]:
+        if self._n_rows == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self._matrix @ query_vector
+        scores[~self._alive] = -np.inf
+        k = min(k, int(self._alive.sum()))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def search_by_vector_with_ids(self, embedding, k=4):
+        # Returns (ids, documents, cosine similarities, unit vectors) of the top k
+        with self._lock:
+            rows, scores = self._top_rows(normalize(embedding), k)
+            ids, documents = self._documents_with_ids(rows)
+            return ids, documents, scores, self.get_vectors(rows)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        with self._lock:
+            rows, scores = self._top_rows(normalize(embedding), k)
+            return list(zip(self._documents(rows), scores.tolist()))
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any):
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k)
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4, **kwargs: Any):
+        # Cosine similarity in [-1, 1] mapped to a relevance score in [0, 1]
+        return [
+            (doc, (score + 1) / 2)
+            for doc, score in self.similarity_search_with_score(query, k)
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        query = normalize(embedding)
+        with self._lock:
+            rows, _ = self._top_rows(query, fetch_k)
+            # Candidate vectors come straight from the memory map, never re-embedded
+            selected = maximal_marginal_relevance(
+                query, self.get_vectors(rows), k=k, lambda_mult=lambda_mult
+            )
+            return self._documents(rows[selected])
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(embedding, k, fetch_k, lambda_mult)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        persist_directory: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        vectordb = cls(persist_directory=persist_directory, embedding_function=embedding)
+        vectordb.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vectordb
@@ -0,0 +1,214 @@
+# pdf_documents.py
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from langchain.document_loaders import PDFPlumberLoader
+from langchain.schema import Document
+
+from metrics import peak_rss_bytes
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+_HEADER_BYTES = 1024
+_TRAILER_BYTES = 4096
+
+
+class InvalidPDFError(ValueError):
+    pass
+
+
+def check_pdf_structure(path):
+    # Cheap sanity checks that reject obviously broken uploads in
+    # milliseconds, before anything is handed to a PDF parser
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(_HEADER_BYTES)
+        f.seek(max(size - _TRAILER_BYTES, 0))
+        trailer = f.read()
+    if b"%PDF-" not in header:
+        raise InvalidPDFError("missing %PDF- header")
+    if b"startxref" not in trailer:
+        raise InvalidPDFError("missing startxref")
+    if b"%%EOF" not in trailer:
+        raise InvalidPDFError("missing %%EOF marker, file is truncated")
+
+
+def extract_pdf_pages(path):
+    # Validation and extraction in one parse: if pdfplumber can extract the
+    # text, the file is good enough for the rest of the pipeline
+    check_pdf_structure(path)
+    return PDFPlumberLoader(path).load()
+
+
+def try_extract_pdf_pages(path):
+    # Returns (pages, None) or (None, reason)
+    try:
+        return extract_pdf_pages(path), None
+    except Exception as e:
+        return None, f"{e.__class__.__name__}: {e}"
+
+
+def timed_extract_pdf_pages(path):
+    # Runs in the extraction pool; returns (pages, error, seconds, worker
+    # peak RSS) so the parent can record the stage, and a file that cannot
+    # be read does not fail the others
+    started = time.perf_counter()
+    pages, error = try_extract_pdf_pages(path)
+    return pages, error, time.perf_counter() - started, peak_rss_bytes()
+
+
+# Per-user values, filled in again for whoever reads the stored pages
+_PATH_METADATA = ("source", "file_path")
+
+
+def process_pool_context():
+    # Context for the PDF extraction and splitting pools. Workers must not
+    # be forked from the app: a fork of a threaded process can inherit a
+    # lock another thread was holding. forkserver forks them from a clean
+    # single-threaded server that has already imported the parsing modules,
+    # so a new pool starts in well under a second; spawn, where forkserver
+    # is unavailable, re-imports them in every worker.
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__", "pdf_documents", "fast_splitter"])
+    return context
+
+
+def pack_pages(pages):
+    # Columnar page encoding: metadata equal on every page (total_pages, the
+    # PDF's own fields) is stored once, the rest as one column per key, and
+    # the page texts as a single string split by their lengths.
+    # Returns (zlib JSON metadata, zlib UTF-8 text).
+    metadatas = [
+        {k: v for k, v in page.metadata.items() if k not in _PATH_METADATA}
+        for page in pages
+    ]
+    common_keys = set.intersection(*map(set, metadatas)) if metadatas else set()
+    constant, columns = {}, {}
+    for key in sorted(common_keys):
+        values = [metadata[key] for metadata in metadatas]
+        if all(value == values[0] for value in values):
+            constant[key] = values[0]
+        else:
+            columns[key] = values
+    header = {
+        "lengths": [len(page.page_content) for page in pages],
+        "constant": constant,
+        "columns": columns,
+    }
+    rest = [{k: v for k, v in m.items() if k not in common_keys} for m in metadatas]
+    if any(rest):
+        header["rest"] = rest
+    text = "".join(page.page_content for page in pages)
+    return (
+        zlib.compress(json.dumps(header, ensure_ascii=False).encode("utf-8")),
+        zlib.compress(text.encode("utf-8")),
+    )
+
+
+def unpack_pages(header_blob, text_blob, path):
+    header = json.loads(zlib.decompress(header_blob).decode("utf-8"))
+    text = zlib.decompress(text_blob).decode("utf-8")
+    rest = header.get("rest") or [{}] * len(header["lengths"])
+    pages = []
+    start = 0
+    for i, length in enumerate(header["lengths"]):
+        metadata = {"source": path, "file_path": path, **header["constant"]}
+        for key, values in header["columns"].items():
+            metadata[key] = values[i]
+        metadata.update(rest[i])
+        pages.append(Document(page_content=text[start : start + length], metadata=metadata))
+        start += length
+    return pages
+
+
+class PageStore:
+    # Extracted pages of every PDF parsed so far, on disk and keyed by
+    # content hash, so rebuilding a store or re-chunking with other settings
+    # never runs pdfplumber again. Shared by the app and the ingest workers.
+    # Least recently used files are evicted once max_files is exceeded.
+    def __init__(self, path, max_files=5000):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_files = max_files
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (file_hash TEXT PRIMARY KEY, "
+            "n_pages INTEGER NOT NULL, header BLOB NOT NULL, text BLOB NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_last_used ON pages(last_used)")
+
+    def put(self, file_hash, pages):
+        header, text = pack_pages(pages)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (file_hash, n_pages, header, text, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (file_hash, len(pages), header, text, time.time()),
+            )
+            self._evict()
+
+    def get(self, file_hash, path):
+        # Pages as extracted from the file, with source pointing at `path`
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT header, text FROM pages WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE pages SET last_used = ? WHERE file_hash = ?", (time.time(), file_hash)
+            )
+        return unpack_pages(row[0], row[1], path)
+
+    def delete(self, file_hashes):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM pages WHERE file_hash = ?", [(h,) for h in file_hashes]
+            )
+
+    def _evict(self):
+        (n_files,) = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()
+        overflow = n_files - self.max_files
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM pages WHERE file_hash IN "
+                "(SELECT file_hash FROM pages ORDER BY last_used LIMIT ?)",
+                (overflow,),
+            )
+            logger.info(f"Page store evicted {overflow} files")
+
+    def stats(self):
+        with self._lock:
+            n_files, n_pages, n_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(n_pages), 0), "
+                "COALESCE(SUM(LENGTH(header) + LENGTH(text)), 0) FROM pages"
+            ).fetchone()
+        return {
+            "files": n_files,
+            "pages": n_pages,
+            "bytes": n_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
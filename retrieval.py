@@ -0,0 +1,166 @@
+# retrieval.py
+
+import asyncio
+from typing import Any, List
+
+import numpy as np
+from langchain.schema import BaseRetriever, Document
+
+from numpy_vectorstore import normalize, maximal_marginal_relevance
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def dense_candidates(vectordb, query_embedding, fetch_k):
+    # Returns (ids, documents, cosine similarities, unit vectors) of the
+    # fetch_k nearest chunks, using their stored embeddings; nothing is re-embedded.
+    # NumpyVectorStore and the index service client search by vector themselves.
+    if hasattr(vectordb, "search_by_vector_with_ids"):
+        return vectordb.search_by_vector_with_ids(query_embedding, fetch_k)
+    result = vectordb._collection.query(
+        query_embeddings=[query_embedding],
+        n_results=fetch_k,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    documents = [
+        Document(page_content=text, metadata=metadata or {})
+        for text, metadata in zip(result["documents"][0], result["metadatas"][0])
+    ]
+    if not documents:
+        return [], [], np.zeros(0, dtype=np.float32), None
+    embeddings = normalize(result["embeddings"][0])
+    similarities = embeddings @ normalize(query_embedding)
+    return result["ids"][0], documents, similarities, embeddings
+
+
+def mmr_search_by_vector(vectordb, query_embedding, k=4, fetch_k=20, lambda_mult=0.5):
+    _, documents, _, embeddings = dense_candidates(vectordb, query_embedding, fetch_k)
+    if not documents:
+        return []
+    selected = maximal_marginal_relevance(
+        normalize(query_embedding), embeddings, k=k, lambda_mult=lambda_mult
+    )
+    return [documents[i] for i in selected]
+
+
+def _min_max(scores):
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+    return {key: (score - low) / (high - low) for key, score in scores.items()}
+
+
+class MMRRetriever(BaseRetriever):
+    # MMR over the fetch_k nearest chunks using the embeddings stored in the
+    # vector store and a single batched NumPy similarity matrix
+    vectordb: Any
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        query_embedding = self.vectordb._embedding_function.embed_query(query)
+        return mmr_search_by_vector(
+            self.vectordb, query_embedding, self.k, self.fetch_k, self.lambda_mult
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager=None
+    ) -> List[Document]:
+        # The query embedding is awaited, the local search runs off the loop
+        query_embedding = await self.vectordb._embedding_function.aembed_query(query)
+        return await asyncio.to_thread(
+            mmr_search_by_vector,
+            self.vectordb,
+            query_embedding,
+            self.k,
+            self.fetch_k,
+            self.lambda_mult,
+        )
+
+
+class HybridRetriever(BaseRetriever):
+    # Fuses min-max normalised BM25 and cosine scores:
+    #     score = alpha * dense + (1 - alpha) * bm25
+    # If each of the top k lexical hits contains at least fast_path_coverage
+    # of the query terms, those are returned without embedding the query.
+    # search_lexical and fuse expose the two halves, so a caller can act on
+    # a fast path hit before anything embeds the query.
+    vectordb: Any
+    lexical_index: Any
+    k: int = 4
+    fetch_k: int = 20
+    alpha: float = 0.5
+    fast_path_coverage: float = 1.0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _fast_path(self, query, lexical):
+        top_lexical = lexical[: self.k]
+        if len(top_lexical) == self.k and all(
+            coverage >= self.fast_path_coverage for _, _, coverage in top_lexical
+        ):
+            logger.info(f"Lexical fast path for '{query}'")
+            return self.lexical_index.get_documents(
+                [chunk_id for chunk_id, _, _ in top_lexical]
+            )
+        return None
+
+    def search_lexical(self, query):
+        # Returns (lexical hits, fast path documents or None)
+        lexical = self.lexical_index.search(query, self.fetch_k)
+        return lexical, self._fast_path(query, lexical)
+
+    def fuse(self, query, lexical):
+        query_embedding = self.vectordb._embedding_function.embed_query(query)
+        return self._fuse(lexical, query_embedding)
+
+    async def afuse(self, query, lexical):
+        query_embedding = await self.vectordb._embedding_function.aembed_query(query)
+        return await asyncio.to_thread(self._fuse, lexical, query_embedding)
+
+    def _fuse(self, lexical, query_embedding):
+        ids, documents, similarities, _ = dense_candidates(
+            self.vectordb, query_embedding, self.fetch_k
+        )
+        dense_scores = _min_max(dict(zip(ids, (float(s) for s in similarities))))
+        lexical_scores = _min_max({chunk_id: score for chunk_id, score, _ in lexical})
+
+        fused = {
+            chunk_id: self.alpha * dense_scores.get(chunk_id, 0.0)
+            + (1 - self.alpha) * lexical_scores.get(chunk_id, 0.0)
+            for chunk_id in dense_scores.keys() | lexical_scores.keys()
+        }
+        top_ids = sorted(fused, key=fused.get, reverse=True)[: self.k]
+
+        documents_by_id = dict(zip(ids, documents))
+        documents_by_id.update(
+            self.lexical_index.get_documents_by_id(
+                [chunk_id for chunk_id in top_ids if chunk_id not in documents_by_id]
+            )
+        )
+        return [
+            documents_by_id[chunk_id] for chunk_id in top_ids if chunk_id in documents_by_id
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        lexical, documents = self.search_lexical(query)
+        if documents is not None:
+            return documents
+        return self.fuse(query, lexical)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager=None
+    ) -> List[Document]:
+        lexical, documents = await asyncio.to_thread(self.search_lexical, query)
+        if documents is not None:
+            return documents
+        return await self.afuse(query, lexical)
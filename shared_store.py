@@ -0,0 +1,226 @@
+# shared_store.py
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+
+from langchain.schema import Document
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-user values, filled in again for whoever reuses the stored chunks
+_USER_METADATA = ("source", "file_path")
+
+
+def _pack_documents(documents):
+    return zlib.compress(
+        json.dumps(
+            [
+                [
+                    doc.page_content,
+                    {k: v for k, v in doc.metadata.items() if k not in _USER_METADATA},
+                ]
+                for doc in documents
+            ],
+            ensure_ascii=False,
+        ).encode("utf-8")
+    )
+
+
+def _unpack_documents(blob, path):
+    return [
+        Document(page_content=text, metadata=dict(metadata, source=path, file_path=path))
+        for text, metadata in json.loads(zlib.decompress(blob).decode("utf-8"))
+    ]
+
+
+class SharedDocumentStore:
+    # Content-addressed store shared by all users, keyed by PDF sha256:
+    # - blobs/: one copy of each uploaded PDF, hardlinked into users' docs/
+    # - chunks with their vectors per (chunking settings, embedding model),
+    #   so the same paper uploaded by another user is not split or embedded
+    #   again, only written into that user's own index
+    # Every (userid, file name) holding a file is a reference; when the last
+    # reference to a file goes, its blob and chunks are deleted.
+    # Parsed pages live in the page store (pdf_documents.PageStore).
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "documents.sqlite3"),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Parsed pages used to be kept here in a documents table; they now
+        # live in the page store, so drop the old copy and reclaim its space
+        if self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents'"
+        ).fetchone():
+            self._conn.execute("DROP TABLE IF EXISTS documents")
+            self._conn.execute("VACUUM")
+            logger.info("Dropped the documents table from the shared store")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_sets (file_hash TEXT NOT NULL, "
+            "chunk_key TEXT NOT NULL, embedding_model TEXT NOT NULL, "
+            "n_pages INTEGER NOT NULL, chunks BLOB NOT NULL, vectors BLOB NOT NULL, "
+            "PRIMARY KEY (file_hash, chunk_key, embedding_model))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS refs (userid TEXT NOT NULL, name TEXT NOT NULL, "
+            "file_hash TEXT NOT NULL, created REAL NOT NULL, PRIMARY KEY (userid, name))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS refs_file_hash ON refs(file_hash)")
+
+    def blob_path(self, file_hash):
+        return os.path.join(self.directory, "blobs", file_hash[:2], f"{file_hash}.pdf")
+
+    def add_file(self, userid, name, src, dest, file_hash):
+        # Stores an upload for (userid, name) at dest. The reference is taken
+        # first: from then on _collect cannot delete the blob, so the
+        # existence check in _link_file holds until the link is made.
+        self.add_ref(userid, name, file_hash)
+        return self._link_file(src, dest, file_hash)
+
+    def _link_file(self, src, dest, file_hash):
+        # Moves the upload into the blob store unless the content is already
+        # there, then hardlinks the blob to dest (copies across filesystems).
+        # The upload is only removed once dest exists.
+        blob = self.blob_path(file_hash)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            tmp_path = f"{blob}.{os.getpid()}.tmp"
+            shutil.move(src, tmp_path)
+            os.replace(tmp_path, blob)
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(blob, dest)
+        except OSError:
+            shutil.copyfile(blob, dest)
+        if os.path.exists(src):
+            os.remove(src)
+        return dest
+
+    def add_ref(self, userid, name, file_hash):
+        # A user replacing a file with new content drops the old reference
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash FROM refs WHERE userid = ? AND name = ?", (userid, name)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO refs (userid, name, file_hash, created) "
+                "VALUES (?, ?, ?, ?)",
+                (userid, name, file_hash, time.time()),
+            )
+        if row and row[0] != file_hash:
+            self._collect([row[0]])
+
+    def remove_ref(self, userid, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash FROM refs WHERE userid = ? AND name = ?", (userid, name)
+            ).fetchone()
+            self._conn.execute(
+                "DELETE FROM refs WHERE userid = ? AND name = ?", (userid, name)
+            )
+        if row:
+            self._collect([row[0]])
+
+    def release_user(self, userid):
+        # Drops every reference of the user; returns the file hashes freed
+        with self._lock:
+            hashes = [
+                file_hash
+                for (file_hash,) in self._conn.execute(
+                    "SELECT DISTINCT file_hash FROM refs WHERE userid = ?", (userid,)
+                )
+            ]
+            self._conn.execute("DELETE FROM refs WHERE userid = ?", (userid,))
+        freed = self._collect(hashes)
+        logger.info(
+            f"Released {len(hashes)} shared files of user {userid}, {len(freed)} freed"
+        )
+        return freed
+
+    def _collect(self, file_hashes):
+        freed = []
+        with self._lock:
+            for file_hash in file_hashes:
+                # Re-checked in a write transaction: another process may have
+                # just added a reference to the same content. The blob is
+                # deleted before the transaction commits, so a reference
+                # added after the check (which waits for the commit) always
+                # finds the blob gone and stores its upload again.
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    (n_refs,) = self._conn.execute(
+                        "SELECT COUNT(*) FROM refs WHERE file_hash = ?", (file_hash,)
+                    ).fetchone()
+                    if n_refs == 0:
+                        self._conn.execute(
+                            "DELETE FROM chunk_sets WHERE file_hash = ?", (file_hash,)
+                        )
+                        # Users' hardlinks keep their own docs/ files alive
+                        if os.path.exists(self.blob_path(file_hash)):
+                            os.remove(self.blob_path(file_hash))
+                        freed.append(file_hash)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        return freed
+
+    def ref_count(self, file_hash):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM refs WHERE file_hash = ?", (file_hash,)
+            ).fetchone()[0]
+
+    def put_chunks(self, file_hash, chunk_key, embedding_model, n_pages, chunks, vectors):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunk_sets (file_hash, chunk_key, embedding_model, "
+                "n_pages, chunks, vectors) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    file_hash,
+                    chunk_key,
+                    embedding_model,
+                    n_pages,
+                    _pack_documents(chunks),
+                    array("f", [x for vector in vectors for x in vector]).tobytes(),
+                ),
+            )
+
+    def get_chunks(self, file_hash, chunk_key, embedding_model, path):
+        # Returns (n_pages, chunks, vectors) or None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT n_pages, chunks, vectors FROM chunk_sets WHERE file_hash = ? "
+                "AND chunk_key = ? AND embedding_model = ?",
+                (file_hash, chunk_key, embedding_model),
+            ).fetchone()
+        if row is None:
+            return None
+        n_pages, chunks_blob, vectors_blob = row
+        chunks = _unpack_documents(chunks_blob, path)
+        flat = array("f", vectors_blob).tolist()
+        dim = len(flat) // len(chunks) if chunks else 0
+        vectors = [flat[i * dim : (i + 1) * dim] for i in range(len(chunks))]
+        return n_pages, chunks, vectors
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: self._conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+                for name in ("chunk_sets", "refs")
+            }
@@ -0,0 +1,72 @@
+# tests/test_embedding_cache.py
+#
+# CachedEmbeddings over SQLiteEmbeddingCache: texts already in the cache,
+# including from an earlier process, never reach the underlying model.
+
+import asyncio
+
+from benchmarks.fake_models import FakeEmbeddings
+from embedding_cache import CachedEmbeddings, SQLiteEmbeddingCache
+from lru_cache import LRUCache
+
+DIM = 8
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self, dim=DIM):
+        super().__init__(dim)
+        self.documents = []
+        self.queries = []
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def test_hits_skip_the_underlying_model(tmp_path):
+    underlying = CountingEmbeddings()
+    cache = SQLiteEmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    embeddings = CachedEmbeddings(underlying, cache)
+    expected = FakeEmbeddings(DIM).embed_documents(["a", "b", "c"])
+
+    assert embeddings.embed_documents(["a", "b", "a"]) == [expected[0], expected[1], expected[0]]
+    assert underlying.documents == ["a", "b"]
+    assert embeddings.embed_documents(["b", "c", "a"]) == [expected[1], expected[2], expected[0]]
+    assert underlying.documents == ["a", "b", "c"]
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_hits_survive_reopening_the_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    texts = ["first chunk", "second chunk"]
+    CachedEmbeddings(CountingEmbeddings(), SQLiteEmbeddingCache(path)).embed_documents(texts)
+
+    underlying = CountingEmbeddings()
+    cache = SQLiteEmbeddingCache(path)
+    embeddings = CachedEmbeddings(underlying, cache)
+
+    expected = FakeEmbeddings(DIM).embed_documents(texts)
+    assert len(cache) == 2
+    assert embeddings.embed_documents(texts) == expected
+    assert asyncio.run(embeddings.aembed_documents(texts[:1])) == expected[:1]
+    assert underlying.documents == []
+    assert (cache.hits, cache.misses) == (3, 0)
+
+
+def test_queries_are_cached_apart_from_documents(tmp_path):
+    underlying = CountingEmbeddings()
+    query_cache = LRUCache(16)
+    embeddings = CachedEmbeddings(
+        underlying, SQLiteEmbeddingCache(str(tmp_path / "cache.sqlite3")), query_cache=query_cache
+    )
+
+    embeddings.embed_documents(["what is attention"])
+    vector = embeddings.embed_query("what is attention")
+    assert underlying.queries == ["what is attention"]
+    assert embeddings.embed_query("what is attention") == vector
+    assert underlying.queries == ["what is attention"]
+    assert query_cache.stats()["hits"] == 1
@@ -0,0 +1,89 @@
+# tests/test_embedding_scheduler.py
+#
+# EmbeddingScheduler against benchmarks.stub_embedding_server: batching,
+# 429 backoff (Retry-After and AIMD) and recovery.
+
+import openai
+import pytest
+
+from benchmarks.fake_models import FakeEmbeddings
+from benchmarks.stub_embedding_server import StubEmbeddingServer
+from embedding_scheduler import EmbeddingScheduler
+
+DIM = 8
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setattr(openai, "api_key", "sk-test")
+
+
+def _texts(n):
+    return [f"chunk {i} about attention and retrieval" for i in range(n)]
+
+
+def _scheduler(server, **kwargs):
+    kwargs.setdefault("initial_backoff", 0.01)
+    return EmbeddingScheduler(api_base=server.api_base, **kwargs)
+
+
+def test_batches_keep_order_and_token_budget():
+    texts = _texts(50)
+    with StubEmbeddingServer(dim=DIM) as server:
+        scheduler = _scheduler(server, max_batch_tokens=40, max_concurrency=3)
+        vectors = scheduler.embed(texts)
+
+    assert vectors == FakeEmbeddings(DIM).embed_documents(texts)
+    batches = scheduler.make_batches(texts)
+    assert len(batches) > 1
+    assert all(n_tokens <= 40 for _, n_tokens in batches)
+    assert sorted(len(r["inputs"]) for r in server.requests) == sorted(
+        len(indices) for indices, _ in batches
+    )
+    assert scheduler.metrics.snapshot()["requests"] == len(batches)
+    assert scheduler.metrics.snapshot()["texts"] == len(texts)
+
+
+def test_rate_limit_honours_retry_after():
+    texts = _texts(4)
+    with StubEmbeddingServer(dim=DIM, rate_limit_first=1, retry_after=0.3) as server:
+        scheduler = _scheduler(server, max_batch_tokens=10_000, max_concurrency=1)
+        vectors = scheduler.embed(texts)
+
+    assert vectors == FakeEmbeddings(DIM).embed_documents(texts)
+    limited, retried = server.requests
+    assert (limited["status"], retried["status"]) == (429, 200)
+    assert retried["inputs"] == limited["inputs"]
+    assert retried["time"] - limited["time"] >= 0.3
+    metrics = scheduler.metrics.snapshot()
+    assert (metrics["rate_limited"], metrics["retries"], metrics["requests"]) == (1, 1, 1)
+
+
+def test_concurrency_backs_off_and_recovers():
+    # The stub allows 2 requests in flight, the scheduler starts with 8: it
+    # halves its limit on each 429, then finishes every batch
+    texts = _texts(40)
+    with StubEmbeddingServer(dim=DIM, delay=0.05, max_concurrency=2) as server:
+        scheduler = _scheduler(server, max_batch_tokens=10, max_concurrency=8)
+        vectors = scheduler.embed(texts)
+
+    assert vectors == FakeEmbeddings(DIM).embed_documents(texts)
+    n_batches = len(scheduler.make_batches(texts))
+    succeeded = [r for r in server.requests if r["status"] == 200]
+    limited = [r for r in server.requests if r["status"] == 429]
+    assert len(succeeded) == n_batches
+    assert limited
+    # AIMD keeps the scheduler near the limit rather than retrying blindly
+    assert len(limited) < len(succeeded)
+    metrics = scheduler.metrics.snapshot()
+    assert metrics["rate_limited"] == len(limited)
+    assert metrics["requests"] == n_batches
+
+
+def test_rate_limit_gives_up_after_max_retries():
+    with StubEmbeddingServer(dim=DIM, rate_limit_first=10) as server:
+        scheduler = _scheduler(server, max_retries=2)
+        with pytest.raises(openai.error.RateLimitError):
+            scheduler.embed(_texts(1))
+
+    assert [r["status"] for r in server.requests] == [429, 429, 429]
@@ -0,0 +1,57 @@
+# tests/test_fast_splitter.py
+#
+# FastTextSplitter with the default separators must return exactly the
+# chunks of langchain's RecursiveCharacterTextSplitter; checked on random
+# texts built from separators, words and CJK characters.
+
+import random
+
+import pytest
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from fast_splitter import FastTextSplitter
+
+PIECES = [" ", " ", "\n", "\n\n", "\n\n\n", "  ", "。", "，", "a", "bb", "word", "注意力", "模型"]
+
+
+def _random_text(rng):
+    n_pieces = rng.randint(0, 200)
+    text = "".join(rng.choice(PIECES) for _ in range(n_pieces))
+    if rng.random() < 0.2:
+        # A long run without any separator forces the character level
+        text += "x" * rng.randint(1, 120)
+    return text
+
+
+def _random_sizes(rng):
+    chunk_size = rng.randint(1, 80)
+    return chunk_size, rng.randint(0, chunk_size)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_recursive_character_splitter(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        chunk_size, chunk_overlap = _random_sizes(rng)
+        text = _random_text(rng)
+        expected = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        ).split_text(text)
+        chunks = FastTextSplitter(chunk_size, chunk_overlap).split_text(text)
+        assert chunks == expected, (chunk_size, chunk_overlap, text)
+
+
+def test_split_documents_matches_and_keeps_metadata():
+    rng = random.Random(0)
+    documents = [
+        Document(page_content=_random_text(rng), metadata={"source": "a.pdf", "page": i})
+        for i in range(30)
+    ]
+    expected = RecursiveCharacterTextSplitter(chunk_size=40, chunk_overlap=10).split_documents(
+        documents
+    )
+    splits = FastTextSplitter(40, 10).split_documents(documents)
+    assert [(d.page_content, d.metadata) for d in splits] == [
+        (d.page_content, d.metadata) for d in expected
+    ]
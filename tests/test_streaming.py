@@ -0,0 +1,83 @@
+# tests/test_streaming.py
+#
+# astream_qa_chain over benchmarks.fake_models: retrieval event first, then
+# the answer token by token, then the same result dict as qa(...).
+
+import asyncio
+
+import pytest
+
+from benchmarks.fake_models import FakeChatModel, FakeEmbeddings
+from numpy_vectorstore import NumpyVectorStore
+
+TEXTS = [
+    "Attention lets every token look at every other token.",
+    "Retrieval augmented generation grounds answers in documents.",
+    "BM25 ranks documents by term frequency and inverse document frequency.",
+]
+
+
+@pytest.fixture(scope="module")
+def utils(tmp_path_factory):
+    # utils reads its settings at import time
+    work_dir = tmp_path_factory.mktemp("streaming")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        monkeypatch.setenv("LLM_NAME", "fake-chat")
+        monkeypatch.setenv("USER_FILES_DIRECTORY", str(work_dir / "users"))
+        monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(work_dir / "embedding_cache.sqlite3"))
+        import utils
+
+        yield utils
+
+
+@pytest.fixture
+def qa(utils, tmp_path):
+    vectordb = NumpyVectorStore(str(tmp_path / "store"), FakeEmbeddings(16))
+    vectordb.add_texts(TEXTS)
+    return utils.create_qa_chain(
+        vectordb, k=2, llm=FakeChatModel(), condense_question_llm=FakeChatModel()
+    )
+
+
+def _collect(utils, qa, questions):
+    from http_pool import close_http_sessions
+
+    async def ask_all():
+        try:
+            return [
+                [event async for event in utils.astream_qa_chain(qa, question)]
+                for question in questions
+            ]
+        finally:
+            await close_http_sessions()
+
+    return asyncio.run(ask_all())
+
+
+def test_streams_tokens_then_result(utils, qa):
+    (events,) = _collect(utils, qa, ["What does attention do?"])
+
+    retrieved, *token_events, result = events
+    assert retrieved["generated_question"] == "What does attention do?"
+    assert len(retrieved["source_documents"]) == 2
+    assert len(token_events) > 1
+    assert all(set(event) == {"token"} for event in token_events)
+    answer = "".join(event["token"] for event in token_events)
+    assert answer
+    assert result["answer"] == answer
+    assert result["source_documents"] == retrieved["source_documents"]
+    assert result["question"] == "What does attention do?"
+
+
+def test_follow_up_is_condensed_and_remembered(utils, qa):
+    first, second = _collect(utils, qa, ["What does attention do?", "And BM25?"])
+
+    assert second[0]["generated_question"] != "And BM25?"
+    assert second[-1]["generated_question"] == second[0]["generated_question"]
+    assert [message.content for message in second[-1]["chat_history"]] == [
+        "What does attention do?",
+        first[-1]["answer"],
+        "And BM25?",
+        second[-1]["answer"],
+    ]
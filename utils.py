@@ -1,23 +1,28 @@
 # util.py
 
-import chromadb
-from chromadb.config import Settings
-
-client = chromadb.Client(Settings(anonymized_telemetry=False))
-
-from langchain.embeddings.openai import OpenAIEmbeddings
+# chromadb is not imported here: Chroma imports it and creates its client
+# when the first store is opened, so processes that never open one (the UI
+# before a user logs in, numpy or remote backends) do not pay for it
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import DocArrayInMemorySearch, Chroma
-from langchain.document_loaders import TextLoader
-from langchain.chains import RetrievalQA, ConversationalRetrievalChain
+from langchain.vectorstores import Chroma
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema import Document
 from langchain.memory import ConversationBufferMemory
 from langchain.chat_models import ChatOpenAI
-from langchain.document_loaders import TextLoader
-from langchain.document_loaders import PyPDFLoader, PDFPlumberLoader, PyMuPDFLoader
+from langchain.document_loaders import PDFPlumberLoader
 
 
 import os
+import asyncio
+import json
+import hashlib
+import queue
 import shutil
+import threading
+import time
+from collections import OrderedDict
 import openai
 from dotenv import load_dotenv, find_dotenv
 
@@ -26,15 +31,227 @@ _ = load_dotenv(find_dotenv())
 openai.api_key = os.environ["OPENAI_API_KEY"]
 llm_name = os.environ["LLM_NAME"]
 user_files_directory = os.environ["USER_FILES_DIRECTORY"]
+embedding_cache_path = os.environ.get(
+    "EMBEDDING_CACHE_PATH", f"{user_files_directory}/embedding_cache.sqlite3"
+)
+embedding_cache_max_entries = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+embedding_model = os.environ.get("EMBEDDING_MODEL", "text-embedding-ada-002")
+embedding_concurrency = int(os.environ.get("EMBEDDING_CONCURRENCY", 4))
+embedding_batch_tokens = int(os.environ.get("EMBEDDING_BATCH_TOKENS", 16000))
+pdf_extract_workers = int(os.environ.get("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+pdf_extract_timeout = float(os.environ.get("PDF_EXTRACT_TIMEOUT", 300))
+vector_backend = os.environ.get("VECTOR_BACKEND", "chroma")
+retrieval_k = int(os.environ.get("RETRIEVAL_K", 4))
+retrieval_fetch_k = int(os.environ.get("RETRIEVAL_FETCH_K", 20))
+retrieval_lambda_mult = float(os.environ.get("RETRIEVAL_LAMBDA", 0.5))
+retrieval_hybrid = os.environ.get("RETRIEVAL_HYBRID", "0") == "1"
+hybrid_alpha = float(os.environ.get("HYBRID_ALPHA", 0.5))
+lexical_fast_path_coverage = float(os.environ.get("LEXICAL_FAST_PATH_COVERAGE", 1.0))
+query_embedding_cache_max_entries = int(
+    os.environ.get("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", 4096)
+)
+condense_cache_max_entries = int(os.environ.get("CONDENSE_CACHE_MAX_ENTRIES", 4096))
+memory_max_tokens = int(os.environ.get("MEMORY_MAX_TOKENS", 2000))
+vectordb_cache_max_open = int(os.environ.get("VECTORDB_CACHE_MAX_OPEN", 32))
+vectordb_cache_idle_seconds = float(os.environ.get("VECTORDB_CACHE_IDLE_SECONDS", 1800))
+answer_cache_max_entries = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+answer_cache_ttl_seconds = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 86400))
+# Unset: exact question matches only (see AnswerCache)
+answer_cache_similarity = os.environ.get("ANSWER_CACHE_SIMILARITY")
+answer_cache_similarity = float(answer_cache_similarity) if answer_cache_similarity else None
+page_store_enabled = os.environ.get("PAGE_STORE", "1") == "1"
+page_store_path = os.environ.get("PAGE_STORE_PATH", f"{user_files_directory}/page_store.sqlite3")
+page_store_max_files = int(os.environ.get("PAGE_STORE_MAX_FILES", 5000))
+ingest_batch_size = int(os.environ.get("INGEST_BATCH_SIZE", 256))
+ingest_queue_size = int(os.environ.get("INGEST_QUEUE_SIZE", 4))
+# compat: same chunks as RecursiveCharacterTextSplitter, only faster
+# fast: sentence-aware separators, optionally sized in tokens
+# langchain: the RecursiveCharacterTextSplitter itself
+splitter_mode = os.environ.get("SPLITTER_MODE", "compat")
+split_length = os.environ.get("SPLIT_LENGTH", "chars")
+split_workers = int(os.environ.get("SPLIT_WORKERS", 1))
+shared_store_enabled = os.environ.get("SHARED_STORE", "1") == "1"
+shared_store_directory = os.environ.get(
+    "SHARED_STORE_DIRECTORY", f"{user_files_directory}/.shared"
+)
+
+from embedding_cache import SQLiteEmbeddingCache, CachedEmbeddings
+from embedding_scheduler import EmbeddingScheduler, ScheduledEmbeddings
+from manifest import UserManifest, file_sha256, make_chunk_ids
+from answer_cache import AnswerCache
+from numpy_vectorstore import NumpyVectorStore
+from retrieval import MMRRetriever, HybridRetriever
+from bm25_index import BM25Index
+from lru_cache import LRUCache
+from chat_memory import TokenBudgetMemory, count_text_tokens
+from shared_store import SharedDocumentStore
+from index_service import RemoteVectorStore, index_service_backend
+from fast_splitter import FastTextSplitter, CHINESE_SEPARATORS, ENGLISH_SEPARATORS
+from http_pool import use_shared_openai_session
+from metrics import add_cache_source, track, observe
+from pdf_documents import (
+    InvalidPDFError,
+    PageStore,
+    process_pool_context,
+    timed_extract_pdf_pages,
+)
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+_embedding_scheduler = None
+_embedding = None
+_shared_store = None
+_page_store = None
+query_embedding_cache = LRUCache(query_embedding_cache_max_entries)
+condense_cache = LRUCache(condense_cache_max_entries)
+
+
+def get_embedding_cache():
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = SQLiteEmbeddingCache(
+                embedding_cache_path, max_entries=embedding_cache_max_entries
+            )
+    return _embedding_cache
+
+
+def get_embedding_scheduler():
+    global _embedding_scheduler
+    with _embedding_cache_lock:
+        if _embedding_scheduler is None:
+            _embedding_scheduler = EmbeddingScheduler(
+                model=embedding_model,
+                max_batch_tokens=embedding_batch_tokens,
+                max_concurrency=embedding_concurrency,
+                api_base=os.environ.get("OPENAI_API_BASE"),
+            )
+    return _embedding_scheduler
+
+
+def get_shared_store():
+    # None when SHARED_STORE=0, then every user's files are processed alone
+    global _shared_store
+    if not shared_store_enabled:
+        return None
+    with _embedding_cache_lock:
+        if _shared_store is None:
+            _shared_store = SharedDocumentStore(shared_store_directory)
+    return _shared_store
+
+
+def get_page_store():
+    # None when PAGE_STORE=0, then every rebuild parses its PDFs again
+    global _page_store
+    if not page_store_enabled:
+        return None
+    with _embedding_cache_lock:
+        if _page_store is None:
+            _page_store = PageStore(page_store_path, max_files=page_store_max_files)
+    return _page_store
+
+
+def get_embedding():
+    # Every embedding goes through the shared on-disk cache, so re-ingests,
+    # rebuilds and papers shared across users are only embedded once.
+    # Cache misses are batched and sent concurrently by the scheduler.
+    # The client holds no per-user state, so one instance serves everyone.
+    global _embedding
+    scheduler = get_embedding_scheduler()
+    cache = get_embedding_cache()
+    with _embedding_cache_lock:
+        if _embedding is None:
+            _embedding = CachedEmbeddings(
+                ScheduledEmbeddings(scheduler), cache, query_cache=query_embedding_cache
+            )
+    return _embedding
+
+
+class VectorDBCache:
+    # Process-wide LRU of opened per-user vector stores, so interactive
+    # clicks reuse a warm handle instead of reopening the persist directory
+    def __init__(self, max_open=32, idle_seconds=1800):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Handles are keyed by (userid, backend)
+    def _evict(self):
+        now = time.monotonic()
+        for key, (_, last_used) in list(self._handles.items()):
+            if now - last_used > self.idle_seconds:
+                logger.info(f"Closing idle vectordb {key}")
+                del self._handles[key]
+        while len(self._handles) > self.max_open:
+            key, _ = self._handles.popitem(last=False)
+            logger.info(f"Closing least recently used vectordb {key}")
+
+    def get(self, key, open_fn):
+        with self._lock:
+            if key in self._handles:
+                vectordb, _ = self._handles.pop(key)
+            else:
+                vectordb = open_fn()
+            self._handles[key] = (vectordb, time.monotonic())
+            self._evict()
+            return vectordb
+
+    def put(self, key, vectordb):
+        with self._lock:
+            self._handles.pop(key, None)
+            self._handles[key] = (vectordb, time.monotonic())
+            self._evict()
+
+    def invalidate(self, userid):
+        with self._lock:
+            for key in [key for key in self._handles if key[0] == userid]:
+                del self._handles[key]
+
+
+vectordb_cache = VectorDBCache(vectordb_cache_max_open, vectordb_cache_idle_seconds)
+
+
+_lexical_indexes = {}
+_lexical_indexes_lock = threading.Lock()
+
+
+def load_user_lexical_index(userid):
+    # BM25 index persisted next to the vector store, one handle per user
+    with _lexical_indexes_lock:
+        if userid not in _lexical_indexes:
+            _lexical_indexes[userid] = BM25Index(
+                f"{user_files_directory}/{userid}/bm25.sqlite3"
+            )
+        return _lexical_indexes[userid]
+
+
+def invalidate_user_db(userid):
+    # Must be called before a user's vector store directory is removed or
+    # rebuilt, and after another process (an ingest worker) wrote to it
+    vectordb_cache.invalidate(userid)
+    if vector_backend == "remote":
+        open_vectordb(user_vectordb_directory(userid)).invalidate()
+    elif vector_backend == "chroma":
+        release_chroma_system(user_vectordb_directory(userid))
+    with _lexical_indexes_lock:
+        lexical_index = _lexical_indexes.pop(userid, None)
+    if lexical_index is not None:
+        lexical_index.close()
+
 
 def prettify_source_documents(result):
     source_documents_printout = f"来源信息:\n\n"
+    if result.get("cache_hit"):
+        source_documents_printout += (
+            f"（缓存命中 相似度 {result['cache_hit']:.3f} -- "
+            f"answer served from cache, similarity {result['cache_hit']:.3f}）\n\n"
+        )
     divider = "----------------------------------------\n"
     for doc in result["source_documents"]:
         source_documents_printout += f"{doc.page_content}\n"
@@ -45,16 +262,30 @@ def prettify_source_documents(result):
     return source_documents_printout
 
 
+CHAT_HISTORY_HEADER = f"历史对话:\n\n"
+
+
+def prettify_chat_message(chat):
+    current_role = chat.__class__.__name__.replace("Message", "")
+    return f"{current_role}: {chat.content}\n"
+
+
+def prettify_chat_turn(question, answer):
+    # One question/answer pair, for appending to an already rendered history
+    return f"Human: {question}\nAI: {answer}\n"
+
+
 def prettify_chat_history(result):
-    chat_history_printout = f"历史对话:\n\n"
-    for chat in result["chat_history"]:
-        current_role = chat.to_json()["id"][3].replace("Message", "")
-        current_content = chat.to_json()["kwargs"]["content"]
-        chat_history_printout += f"{current_role}: {current_content}\n"
-    return chat_history_printout
+    return CHAT_HISTORY_HEADER + "".join(
+        prettify_chat_message(chat) for chat in result["chat_history"]
+    )
 
 
 def old_load_db(file, chain_type="stuff", k=2, mmr=False, chinese=True):
+    # Single-file pipeline kept for reference, the app does not use it
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    from langchain.vectorstores import DocArrayInMemorySearch
+
     # load documents
     loader = PDFPlumberLoader(
         file
@@ -98,74 +329,764 @@ def old_load_db(file, chain_type="stuff", k=2, mmr=False, chinese=True):
     return qa
 
 
-def load_pdf(file_list):
-    loders = [PDFPlumberLoader(file) for file in file_list]
+def _iter_process_pool(fn, file_list, max_workers=None, timeout=None):
+    # Yields (file, fn(file)) as soon as each file is done.
+    # pdfplumber is CPU-bound, so files are spread over a process pool.
+    # At most max_workers files are in flight, each one gets `timeout` seconds.
+    max_workers = max_workers or pdf_extract_workers
+    timeout = pdf_extract_timeout if timeout is None else timeout
+
+    if max_workers <= 1 or len(file_list) <= 1:
+        for file in file_list:
+            yield file, fn(file)
+        return
+
+    n_workers = min(max_workers, len(file_list))
+    pool = process_pool_context().Pool(n_workers)
+    pending_files = iter(enumerate(file_list))
+    results = queue.Queue()
+    running = {}
+
+    def submit_next():
+        task = next(pending_files, None)
+        if task is not None:
+            i, file = task
+            running[i] = (file, time.monotonic())
+            pool.apply_async(
+                fn,
+                (file,),
+                callback=lambda result: results.put((i, result, None)),
+                error_callback=lambda error: results.put((i, None, error)),
+            )
+
+    try:
+        for _ in range(n_workers):
+            submit_next()
+        while running:
+            next_deadline = min(started for _, started in running.values()) + timeout
+            try:
+                i, result, error = results.get(
+                    timeout=max(next_deadline - time.monotonic(), 0)
+                )
+            except queue.Empty:
+                file, _ = min(running.values(), key=lambda task: task[1])
+                raise TimeoutError(
+                    f"Extracting {os.path.basename(file)} took longer than {timeout}s"
+                )
+            file, _ = running.pop(i)
+            submit_next()
+            if error is not None:
+                raise error
+            yield file, result
+    finally:
+        # Also kills a hung worker, which would otherwise block shutdown
+        pool.terminate()
+        pool.join()
+
+
+def iter_load_pdf(
+    file_list, max_workers=None, timeout=None, file_hashes=None, on_error=None
+):
+    # Yields (file, pages) as soon as each file has been extracted.
+    # Files parsed in an earlier ingest (see get_page_store) are not parsed
+    # again. A file that cannot be read raises InvalidPDFError, or with
+    # on_error is reported as on_error(file, reason) and left out.
+    file_hashes = file_hashes or {file: file_sha256(file) for file in file_list}
+    page_store = get_page_store()
+    to_parse = []
+    for file in file_list:
+        pages = None
+        if page_store is not None:
+            pages = page_store.get(file_hashes[file], file)
+        if pages is None:
+            to_parse.append(file)
+        else:
+            logger.info(f"Reusing parsed pages of {os.path.basename(file)}")
+            yield file, pages
+    for file, (pages, error, seconds, worker_peak_rss) in _iter_process_pool(
+        timed_extract_pdf_pages, to_parse, max_workers, timeout
+    ):
+        if error:
+            if on_error is None:
+                raise InvalidPDFError(f"{os.path.basename(file)}: {error}")
+            logger.warning(f"Cannot extract {os.path.basename(file)}: {error}")
+            on_error(file, error)
+            continue
+        observe(
+            "load_pdf",
+            seconds,
+            pages=len(pages),
+            peak_rss_bytes=worker_peak_rss,
+            file=os.path.basename(file),
+        )
+        if page_store is not None:
+            page_store.put(file_hashes[file], pages)
+        yield file, pages
+
+
+def load_pdf(file_list, max_workers=None, timeout=None):
+    pages_by_file = dict(iter_load_pdf(file_list, max_workers, timeout))
+    # Keep the sequential order regardless of which file finished first
     docs = []
-    for loader in loders:
-        docs.extend(loader.load())
+    for file in file_list:
+        docs.extend(pages_by_file[file])
     return docs
 
 
-def split_docs(docs, chinese=True):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    if chinese:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=70)
-    splits = text_splitter.split_documents(docs)
+def _chunk_sizes(chinese=True):
+    return (500, 70) if chinese else (1000, 150)
+
+
+def splitter_key(chinese=True, mode=None):
+    # Names the chunking settings; chunks stored in the shared store are only
+    # reused under the same key. compat and langchain split identically.
+    mode = mode or splitter_mode
+    mode = "compat" if mode == "langchain" else mode
+    length = split_length if mode == "fast" else "chars"
+    chunk_size, chunk_overlap = _chunk_sizes(chinese)
+    return f"{mode}:{length}:{chunk_size}:{chunk_overlap}"
+
+
+def make_text_splitter(chinese=True, mode=None):
+    chunk_size, chunk_overlap = _chunk_sizes(chinese)
+    mode = mode or splitter_mode
+    if mode == "langchain":
+        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if mode == "fast":
+        # With SPLIT_LENGTH=tokens the sizes above count cl100k tokens
+        return FastTextSplitter(
+            chunk_size,
+            chunk_overlap,
+            separators=CHINESE_SEPARATORS if chinese else ENGLISH_SEPARATORS,
+            separator_at_end=True,
+            length=split_length,
+        )
+    return FastTextSplitter(chunk_size, chunk_overlap)
+
+
+def split_docs(docs, chinese=True, mode=None):
+    text_splitter = make_text_splitter(chinese, mode)
+    with track("split_docs", pages=len(docs)) as span:
+        if isinstance(text_splitter, FastTextSplitter):
+            splits = text_splitter.split_documents(docs, max_workers=split_workers)
+        else:
+            splits = text_splitter.split_documents(docs)
+        span["chunks"] = len(splits)
     return splits
 
 
-def create_vectordb(splits, persist_directory):
-    embedding = OpenAIEmbeddings()
-    vectordb = Chroma.from_documents(
-        documents=splits, embedding=embedding, persist_directory=persist_directory
+VECTOR_BACKENDS = {
+    # backend: (vector store class, per-user directory name)
+    "chroma": (Chroma, "chroma"),
+    "numpy": (NumpyVectorStore, "vectors"),
+}
+# Stores served by the index service (index_service.py), which keeps them in
+# the same per-user directory as its own backend
+VECTOR_BACKENDS["remote"] = (RemoteVectorStore, VECTOR_BACKENDS[index_service_backend][1])
+
+
+def user_vectordb_directory(userid, backend=None):
+    _, directory_name = VECTOR_BACKENDS[backend or vector_backend]
+    return f"{user_files_directory}/{userid}/{directory_name}/"
+
+
+def release_chroma_system(persist_directory):
+    # Chroma is not multi-process safe: each client keeps the directory's
+    # HNSW index in memory and never sees vectors another process adds.
+    # Every write is logged to the directory's SQLite database first, and a
+    # newly created client replays the log, so a process that did not write
+    # the new chunks itself must open a new client to see them.
+    # chromadb versions that share one client per directory within a process
+    # (SharedSystemClient) would hand the stale one back, so it is dropped;
+    # older versions create a fresh one per Chroma() anyway. Handles still
+    # held elsewhere keep working on their old index.
+    try:
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return
+    getattr(SharedSystemClient, "_identifer_to_system", {}).pop(persist_directory, None)
+
+
+def persist_vectordb(vectordb):
+    # chromadb < 0.4 only writes a store to disk on persist(); later versions
+    # have logged every write before returning, and persist() is a no-op
+    if isinstance(vectordb, Chroma):
+        vectordb.persist()
+
+
+def open_vectordb(persist_directory, backend=None):
+    vectorstore_cls, _ = VECTOR_BACKENDS[backend or vector_backend]
+    return vectorstore_cls(
+        persist_directory=persist_directory, embedding_function=get_embedding()
     )
+
+
+def delete_chunks(vectordb, ids):
+    if isinstance(vectordb, Chroma):
+        vectordb._collection.delete(ids=ids)
+    else:
+        vectordb.delete(ids)
+
+
+def upsert_embeddings(vectordb, ids, documents, embeddings):
+    # Writes chunks whose vectors were computed by the caller
+    texts = [doc.page_content for doc in documents]
+    metadatas = [doc.metadata for doc in documents]
+    if isinstance(vectordb, Chroma):
+        vectordb._collection.upsert(
+            ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts
+        )
+    else:
+        vectordb.add_embeddings(texts, embeddings, metadatas, ids)
+
+
+def get_chunk_documents(vectordb):
+    # Returns (ids, documents) of every chunk in the store
+    if isinstance(vectordb, Chroma):
+        stored = vectordb._collection.get(include=["documents", "metadatas"])
+        return stored["ids"], [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(stored["documents"], stored["metadatas"])
+        ]
+    return vectordb.get_documents()
+
+
+def get_chunk_metadatas(vectordb):
+    # Returns (ids, metadatas) of every chunk in the store
+    if isinstance(vectordb, Chroma):
+        stored = vectordb._collection.get(include=["metadatas"])
+        return stored["ids"], stored["metadatas"]
+    return vectordb.get_metadatas()
+
+
+def create_vectordb(splits, persist_directory, backend=None):
+    embedding = get_embedding()
+    vectorstore_cls, _ = VECTOR_BACKENDS[backend or vector_backend]
+    with track("create_vectordb", chunks=len(splits)):
+        vectordb = vectorstore_cls.from_documents(
+            documents=splits, embedding=embedding, persist_directory=persist_directory
+        )
+    logger.info(f"Embedding cache: {embedding.cache.stats()}")
+    logger.info(f"Embedding throughput: {get_embedding_scheduler().metrics.snapshot()}")
     return vectordb
 
 
-def create_user_vectordb_with_initial_files(file_list, userid):
-    persist_directory = f"{user_files_directory}/{userid}/chroma/"
+def _prefetch(iterable, maxsize):
+    # Runs `iterable` on a background thread, never more than maxsize items
+    # ahead of the consumer, so a slow stage holds back the ones before it
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+        finally:
+            put((done, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def iter_split_pdf(
+    file_list, chinese=True, file_hashes=None, shared_store=None, on_error=None
+):
+    # Yields (file, n_pages, splits, vectors). vectors is None unless the
+    # shared store already holds the file's chunks for these settings.
+    # on_error is passed on to iter_load_pdf.
+    file_hashes = file_hashes or {file: file_sha256(file) for file in file_list}
+    to_load = []
+    for file in file_list:
+        file_hash = file_hashes[file]
+        stored = shared_store and shared_store.get_chunks(
+            file_hash, splitter_key(chinese), embedding_model, file
+        )
+        if stored:
+            logger.info(f"Reusing shared chunks of {os.path.basename(file)}")
+            n_pages, splits, vectors = stored
+            yield file, n_pages, splits, vectors
+            continue
+        to_load.append(file)
+    for file, pages in iter_load_pdf(to_load, file_hashes=file_hashes, on_error=on_error):
+        yield file, len(pages), split_docs(pages, chinese), None
+
+
+def _iter_ingest_batches(
+    file_list, vectordb, manifest, lexical_index, batch_size, progress=None, userid=None
+):
+    # Streaming ingest: extract -> split runs ahead on a bounded queue while
+    # the caller embeds and upserts the fixed-size (documents, ids) batches
+    # yielded here, so peak memory stays flat no matter how many files are
+    # uploaded.
+    # With a manifest, unchanged files are skipped and the chunks of changed
+    # files are replaced by ID; the stale ones are only deleted once the new
+    # ones are written, so a failed re-ingest leaves the old chunks in place.
+    # Files with the same content as another file are skipped.
+    # A lexical index is kept in step with the store: a file's chunks are
+    # added to it once their vectors are written.
+    # A file is only recorded in the manifest (and saved) once all of its
+    # chunks are written, so an interrupted ingest resumes at that file.
+    # progress(file, stage, **info) is called with stage "parsed", "split",
+    # "embedded" and "indexed", or "invalid" (with the error) for a file
+    # that cannot be extracted, which is left out.
+    # Batches are (documents, ids, vectors); vectors holds the ones taken
+    # from the shared store and None for the rest, which the caller fills in
+    # in place before asking for the next batch. For a user's ingest, newly
+    # embedded files are then added to the shared store and referenced.
+    batch_size = batch_size or ingest_batch_size
+    shared_store = get_shared_store() if userid is not None else None
+    progress = progress or (lambda file, stage, **info: None)
+    file_hashes = {file: file_sha256(file) for file in file_list}
+    to_index = []
+    # file hash -> name of the first file in this ingest holding it
+    names_by_hash = {}
+    for file in file_list:
+        name = os.path.basename(file)
+        duplicate = names_by_hash.setdefault(file_hashes[file], name)
+        if duplicate != name:
+            logger.info(f"Skipping {name}, same content as {duplicate}")
+            progress(file, "indexed", skipped=True)
+            continue
+        if manifest is not None:
+            entry = manifest.files.get(name)
+            if (
+                entry
+                and entry["sha256"] == file_hashes[file]
+                and entry["embedding_model"] == embedding_model
+            ):
+                logger.info(f"Skipping unchanged file {name}")
+                progress(file, "indexed", skipped=True)
+                continue
+            duplicate = manifest.find_by_hash(file_hashes[file])
+            if duplicate and duplicate != name:
+                logger.info(f"Skipping {name}, same content as {duplicate}")
+                progress(file, "indexed", skipped=True)
+                continue
+        to_index.append(file)
+    file_list = to_index
+
+    batch, batch_ids, batch_vectors = [], [], []
+    # Per-file vectors of files that are new to the shared store, in batch order
+    batch_owners = []
+    # (file, chunks queued up to and including it, manifest entry, chunks,
+    # vectors to share or None, chunk IDs to delete once it is written), in order
+    pending_files = []
+    n_queued = n_written = 0
+
+    def collect_vectors(owners, vectors):
+        for owner, vector in zip(owners, vectors):
+            if owner is not None:
+                owner.append(vector)
+
+    def complete_written_files():
+        while pending_files and pending_files[0][1] <= n_written:
+            file, _, entry, splits, shared_vectors, stale_ids = pending_files.pop(0)
+            name, file_hash, n_pages, chunk_ids, _ = entry
+            progress(file, "embedded")
+            if lexical_index is not None:
+                lexical_index.add_documents(splits, chunk_ids)
+            if stale_ids:
+                logger.info(f"Deleting {len(stale_ids)} stale chunks of {name}")
+                delete_chunks(vectordb, stale_ids)
+                if lexical_index is not None:
+                    lexical_index.delete(stale_ids)
+            if shared_store is not None:
+                if shared_vectors is not None:
+                    shared_store.put_chunks(
+                        file_hash,
+                        splitter_key(),
+                        embedding_model,
+                        n_pages,
+                        splits,
+                        shared_vectors,
+                    )
+                shared_store.add_ref(userid, name, file_hash)
+            if manifest is not None:
+                manifest.record(*entry)
+                manifest.save()
+            progress(file, "indexed")
+
+    for file, n_pages, splits, vectors in _prefetch(
+        iter_split_pdf(
+            file_list,
+            file_hashes=file_hashes,
+            shared_store=shared_store,
+            on_error=lambda file, error: progress(file, "invalid", error=error),
+        ),
+        ingest_queue_size,
+    ):
+        name = os.path.basename(file)
+        file_hash = file_hashes[file]
+        progress(file, "parsed", pages=n_pages)
+        logger.info(f"Split {name} into {len(splits)} chunks")
+        progress(file, "split", chunks=len(splits))
+        chunk_ids = make_chunk_ids(file_hash, len(splits), name)
+        for split in splits:
+            split.metadata["file_hash"] = file_hash
+        stale_ids = []
+        if manifest is not None and name in manifest.files:
+            # IDs shared with the new chunks are overwritten by the upsert
+            new_ids = set(chunk_ids)
+            stale_ids = [i for i in manifest.files[name]["chunk_ids"] if i not in new_ids]
+
+        shared_vectors = None
+        if vectors is None:
+            vectors = [None] * len(splits)
+            if shared_store is not None:
+                shared_vectors = []
+        batch.extend(splits)
+        batch_ids.extend(chunk_ids)
+        batch_vectors.extend(vectors)
+        batch_owners.extend([shared_vectors] * len(splits))
+        n_queued += len(splits)
+        pending_files.append(
+            (
+                file,
+                n_queued,
+                (name, file_hash, n_pages, chunk_ids, embedding_model),
+                splits,
+                shared_vectors,
+                stale_ids,
+            )
+        )
+        while len(batch) >= batch_size:
+            # The caller has written the batch by the time it asks for the next
+            vectors = batch_vectors[:batch_size]
+            yield batch[:batch_size], batch_ids[:batch_size], vectors
+            collect_vectors(batch_owners[:batch_size], vectors)
+            n_written += batch_size
+            batch, batch_ids = batch[batch_size:], batch_ids[batch_size:]
+            batch_vectors = batch_vectors[batch_size:]
+            batch_owners = batch_owners[batch_size:]
+            complete_written_files()
+        complete_written_files()
+    if batch:
+        yield batch, batch_ids, batch_vectors
+        collect_vectors(batch_owners, batch_vectors)
+        n_written += len(batch)
+        complete_written_files()
+
+
+def _finish_ingest(manifest):
+    if manifest is not None:
+        manifest.save()
+    logger.info(f"Embedding cache: {get_embedding_cache().stats()}")
+    logger.info(f"Embedding throughput: {get_embedding_scheduler().metrics.snapshot()}")
+    if get_shared_store() is not None:
+        logger.info(f"Shared store: {get_shared_store().stats()}")
+    if get_page_store() is not None:
+        logger.info(f"Page store: {get_page_store().stats()}")
+
+
+def _missing_vectors(batch, vectors):
+    # (positions, texts) of the chunks that still have to be embedded
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    return missing, [batch[i].page_content for i in missing]
+
+
+def add_files_to_vectordb(
+    file_list,
+    vectordb,
+    manifest=None,
+    lexical_index=None,
+    batch_size=None,
+    progress=None,
+    userid=None,
+):
+    embedding = get_embedding()
+    embedding_metrics = get_embedding_scheduler().metrics
+    n_chunks = 0
+    for batch, batch_ids, vectors in _iter_ingest_batches(
+        file_list, vectordb, manifest, lexical_index, batch_size, progress, userid
+    ):
+        missing, texts = _missing_vectors(batch, vectors)
+        tokens_before = embedding_metrics.tokens
+        with track("embed", chunks=len(texts)) as span:
+            if texts:
+                for i, vector in zip(missing, embedding.embed_documents(texts)):
+                    vectors[i] = vector
+            span["tokens"] = embedding_metrics.tokens - tokens_before
+        with track("upsert", chunks=len(batch)):
+            upsert_embeddings(vectordb, batch_ids, batch, vectors)
+        n_chunks += len(batch)
+    _finish_ingest(manifest)
+    return n_chunks
+
+
+async def aadd_files_to_vectordb(
+    file_list,
+    vectordb,
+    manifest=None,
+    lexical_index=None,
+    batch_size=None,
+    progress=None,
+    userid=None,
+):
+    # Same pipeline as add_files_to_vectordb, but embedding requests go out
+    # on the event loop over the shared HTTP pool; the blocking extract/split
+    # and local store writes run on worker threads
+    use_shared_openai_session()
+    embedding = get_embedding()
+    embedding_metrics = get_embedding_scheduler().metrics
+    batches = _iter_ingest_batches(
+        file_list, vectordb, manifest, lexical_index, batch_size, progress, userid
+    )
+    n_chunks = 0
+    while True:
+        item = await asyncio.to_thread(next, batches, None)
+        if item is None:
+            break
+        batch, batch_ids, vectors = item
+        missing, texts = _missing_vectors(batch, vectors)
+        tokens_before = embedding_metrics.tokens
+        with track("embed", chunks=len(texts)) as span:
+            if texts:
+                for i, vector in zip(missing, await embedding.aembed_documents(texts)):
+                    vectors[i] = vector
+            span["tokens"] = embedding_metrics.tokens - tokens_before
+        with track("upsert", chunks=len(batch)):
+            await asyncio.to_thread(upsert_embeddings, vectordb, batch_ids, batch, vectors)
+        n_chunks += len(batch)
+    await asyncio.to_thread(_finish_ingest, manifest)
+    return n_chunks
+
+
+def user_manifest_path(userid):
+    return f"{user_files_directory}/{userid}/manifest.json"
+
+
+def load_user_manifest(userid):
+    return UserManifest(user_manifest_path(userid))
+
+
+def release_user_files(userid, file_hashes):
+    # Called after a user's directory is deleted, with the hashes of the
+    # files it held. With the shared store, content another user still
+    # references is kept; without it the pages go, at worst costing a parse.
+    if get_shared_store() is not None:
+        file_hashes = get_shared_store().release_user(userid)
+    if get_page_store() is not None:
+        get_page_store().delete(file_hashes)
+
+
+def rebuild_user_manifest(userid):
+    persist_directory = user_vectordb_directory(userid)
+    if os.path.exists(persist_directory):
+        ids, metadatas = get_chunk_metadatas(load_user_db(userid))
+        manifest = UserManifest.rebuild_from_chunks(
+            user_manifest_path(userid),
+            ids,
+            metadatas,
+            embedding_model,
+            docs_dir=f"{user_files_directory}/{userid}/docs",
+        )
+    else:
+        manifest = UserManifest(user_manifest_path(userid))
+    manifest.save()
+    return manifest
+
+
+def create_user_vectordb_with_initial_files(file_list, userid, backend=None):
+    backend = backend or vector_backend
+    persist_directory = user_vectordb_directory(userid, backend)
     if not os.path.exists(persist_directory):
         os.makedirs(persist_directory)
-    docs = load_pdf(file_list)
-    splits = split_docs(docs)
-    vectordb = create_vectordb(splits, persist_directory)
+    vectordb = open_vectordb(persist_directory, backend)
+    _ = add_files_to_vectordb(
+        file_list,
+        vectordb,
+        load_user_manifest(userid),
+        load_user_lexical_index(userid),
+        userid=userid,
+    )
+    vectordb_cache.put((userid, backend), vectordb)
     message = f"Created user vectordb with {len(file_list)} files. User ID: {userid}"
     return message, vectordb
 
 
-def load_user_db(userid):
-    embedding = OpenAIEmbeddings()
-    persist_directory = f"{user_files_directory}/{userid}/chroma/"
-    logger.info("load_user_db(userid)")
+def open_user_db(userid, backend=None):
+    persist_directory = user_vectordb_directory(userid, backend)
     logger.info(f"user_files_directory: {user_files_directory}")
     logger.info(f"Loading user db from {persist_directory}")
-    vectordb = Chroma(persist_directory=persist_directory, embedding_function=embedding)
-    return vectordb
+    return open_vectordb(persist_directory, backend)
+
+
+def load_user_db(userid, backend=None):
+    logger.info("load_user_db(userid)")
+    backend = backend or vector_backend
+    with track("load_user_db"):
+        return vectordb_cache.get((userid, backend), lambda: open_user_db(userid, backend))
 
 
 def load_and_add_new_files_to_user_db(file_list, userid):
-    docs = load_pdf(file_list)
-    splits = split_docs(docs)
     vectordb = load_user_db(userid)
-    _ = vectordb.add_documents(splits)
+    _ = add_files_to_vectordb(
+        file_list,
+        vectordb,
+        load_user_manifest(userid),
+        load_user_lexical_index(userid),
+        userid=userid,
+    )
     return vectordb
 
 
+async def aload_user_db(userid, backend=None):
+    return await asyncio.to_thread(load_user_db, userid, backend)
+
+
+def discard_user_file(userid, file):
+    # An upload that turned out unreadable is removed from the user's docs/,
+    # otherwise every later ingest would pick it up and fail on it again
+    if os.path.dirname(os.path.abspath(file)) != os.path.abspath(
+        f"{user_files_directory}/{userid}/docs"
+    ):
+        return
+    if os.path.exists(file):
+        os.remove(file)
+    if get_shared_store() is not None:
+        get_shared_store().remove_ref(userid, os.path.basename(file))
+
+
+async def aingest_user_files(file_list, userid, progress=None, backend=None):
+    # Used by background ingest workers. Handles are opened per job and not
+    # cached, the app process re-opens the user's store once the job is done.
+    # Other workers may write to the same store between this worker's jobs,
+    # so the client is persisted and dropped at the end of each job; a stale
+    # one could write an index that is missing their vectors.
+    progress = progress or (lambda file, stage, **info: None)
+
+    def job_progress(file, stage, **info):
+        if stage == "invalid":
+            discard_user_file(userid, file)
+        progress(file, stage, **info)
+
+    persist_directory = user_vectordb_directory(userid, backend)
+    if not os.path.exists(persist_directory):
+        os.makedirs(persist_directory)
+    vectordb = await asyncio.to_thread(open_vectordb, persist_directory, backend)
+    lexical_index = BM25Index(f"{user_files_directory}/{userid}/bm25.sqlite3")
+    try:
+        return await aadd_files_to_vectordb(
+            file_list,
+            vectordb,
+            load_user_manifest(userid),
+            lexical_index,
+            progress=job_progress,
+            userid=userid,
+        )
+    finally:
+        lexical_index.close()
+        await asyncio.to_thread(persist_vectordb, vectordb)
+        if isinstance(vectordb, Chroma):
+            release_chroma_system(persist_directory)
+
+
+answer_cache = AnswerCache(
+    max_entries=answer_cache_max_entries,
+    ttl_seconds=answer_cache_ttl_seconds,
+    similarity_threshold=answer_cache_similarity,
+)
+
+
+def load_user_retrieval_settings(userid):
+    # Optional {user_files_directory}/{userid}/retrieval.json overrides the
+    # RETRIEVAL_* / HYBRID_ALPHA / LEXICAL_FAST_PATH_COVERAGE /
+    # MEMORY_MAX_TOKENS defaults per user
+    settings = {
+        "k": retrieval_k,
+        "fetch_k": retrieval_fetch_k,
+        "lambda_mult": retrieval_lambda_mult,
+        "hybrid": retrieval_hybrid,
+        "alpha": hybrid_alpha,
+        "fast_path_coverage": lexical_fast_path_coverage,
+        "memory_max_tokens": memory_max_tokens,
+    }
+    settings_path = f"{user_files_directory}/{userid}/retrieval.json"
+    if os.path.exists(settings_path):
+        with open(settings_path, "r", encoding="utf-8") as f:
+            user_settings = json.load(f)
+        settings.update({key: user_settings[key] for key in settings if key in user_settings})
+    return settings
+
+
 def create_qa_chain(
-    vectordb, llm_name="gpt-3.5-turbo-0613", chain_type="stuff", k=4, mmr=True
+    vectordb,
+    llm_name="gpt-3.5-turbo-0613",
+    chain_type="stuff",
+    k=4,
+    mmr=True,
+    fetch_k=20,
+    lambda_mult=0.5,
+    lexical_index=None,
+    alpha=0.5,
+    fast_path_coverage=1.0,
+    memory_max_tokens=None,
+    llm=None,
+    condense_question_llm=None,
 ):
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        input_key="question",
-        output_key="answer",
-        return_messages=True,
+    # llm / condense_question_llm can be swapped for local fakes in tests
+    condense_question_llm = condense_question_llm or ChatOpenAI(
+        model_name=llm_name, temperature=0
     )
+    if memory_max_tokens:
+        # Recent turns up to the token budget, older turns as a rolling summary
+        memory = TokenBudgetMemory(
+            llm=condense_question_llm,
+            max_token_limit=memory_max_tokens,
+            memory_key="chat_history",
+            input_key="question",
+            output_key="answer",
+            return_messages=True,
+        )
+    else:
+        memory = ConversationBufferMemory(
+            memory_key="chat_history",
+            input_key="question",
+            output_key="answer",
+            return_messages=True,
+        )
     retriever = vectordb.as_retriever(search_type="similarity", search_kwargs={"k": k})
     if mmr:
-        retriever = vectordb.as_retriever(search_type="mmr", search_kwargs={"k": k})
+        retriever = MMRRetriever(
+            vectordb=vectordb, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        )
+    if lexical_index is not None:
+        retriever = HybridRetriever(
+            vectordb=vectordb,
+            lexical_index=lexical_index,
+            k=k,
+            fetch_k=fetch_k,
+            alpha=alpha,
+            fast_path_coverage=fast_path_coverage,
+        )
 
     qa_chain = ConversationalRetrievalChain.from_llm(
-        llm=ChatOpenAI(model_name=llm_name, temperature=0),
+        # Only the answer is streamed, the condensed question is used whole
+        llm=llm or ChatOpenAI(model_name=llm_name, temperature=0, streaming=True),
+        condense_question_llm=condense_question_llm,
         chain_type=chain_type,
         retriever=retriever,
         return_source_documents=True,
@@ -174,3 +1095,188 @@ def create_qa_chain(
         memory=memory,
     )
     return qa_chain
+
+
+def create_user_qa_chain(userid, vectordb):
+    settings = load_user_retrieval_settings(userid)
+    lexical_index = None
+    if settings.pop("hybrid"):
+        lexical_index = load_user_lexical_index(userid)
+        if len(lexical_index) == 0:
+            # Users ingested before the lexical index existed
+            ids, documents = get_chunk_documents(vectordb)
+            logger.info(f"Building lexical index for user {userid} from {len(ids)} chunks")
+            lexical_index.add_documents(documents, ids)
+    return create_qa_chain(vectordb, lexical_index=lexical_index, **settings)
+
+
+class _AsyncTokenQueueHandler(AsyncCallbackHandler):
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    async def on_llm_new_token(self, token, **kwargs):
+        await self.tokens.put(token)
+
+
+def _condense_cache_key(qa, question, chat_history_str):
+    # Same history + same question always condense to the same question,
+    # e.g. after clear_conv_hsitory or when a user asks again
+    history_digest = hashlib.sha256(chat_history_str.encode("utf-8")).hexdigest()
+    llm_name = getattr(qa.question_generator.llm, "model_name", "")
+    return (llm_name, history_digest, question)
+
+
+async def acondense_question(qa, question, chat_history_str):
+    key = _condense_cache_key(qa, question, chat_history_str)
+    generated_question = condense_cache.get(key)
+    if generated_question is None:
+        with track("condense"):
+            generated_question = await qa.question_generator.arun(
+                question=question, chat_history=chat_history_str
+            )
+        condense_cache.put(key, generated_question)
+    return generated_question
+
+
+def _prompt_tokens(docs, question, chat_history_str):
+    # Context + question + history, without the template's few fixed tokens;
+    # streamed completions are counted one token per callback
+    return sum(count_text_tokens(doc.page_content) for doc in docs) + count_text_tokens(
+        question + chat_history_str
+    )
+
+
+def get_cache_metrics():
+    return {
+        "embedding_cache": get_embedding_cache().stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "condense_cache": condense_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "page_store": get_page_store().stats() if get_page_store() else None,
+    }
+
+
+# Served as chatpdf_cache_* on /metrics next to the stage metrics
+add_cache_source(get_cache_metrics)
+
+
+async def astream_qa_chain(qa, question, userid=None, corpus_version=None):
+    # Runs the same steps as ConversationalRetrievalChain._call, but yields
+    # as it goes: first {"generated_question", "source_documents"} once
+    # retrieval is done, then {"token"} per answer token, and finally the
+    # full result dict with the same keys as qa({"question": question}).
+    # With a userid and corpus_version, answers are served from and stored
+    # in answer_cache; the result then carries "cache_hit" (similarity).
+    # The condense, query embedding and answer requests are awaited over the
+    # shared HTTP pool, so one worker can serve many users while they wait
+    # on OpenAI.
+    use_shared_openai_session()
+    inputs = {"question": question}
+    chat_history = qa.memory.load_memory_variables(inputs)[qa.memory.memory_key]
+    get_chat_history = qa.get_chat_history or _get_chat_history
+    chat_history_str = get_chat_history(chat_history)
+    if chat_history_str:
+        generated_question = await acondense_question(qa, question, chat_history_str)
+    else:
+        generated_question = question
+
+    use_cache = userid is not None and corpus_version is not None
+    # Hybrid retrieval searches lexically first; on a fast path hit the
+    # question is never embedded, so the cache only tries an exact match
+    lexical = fast_path_documents = None
+    if isinstance(qa.retriever, HybridRetriever):
+        with track("lexical_search"):
+            lexical, fast_path_documents = await asyncio.to_thread(
+                qa.retriever.search_lexical, generated_question
+            )
+    if use_cache:
+        cached, similarity, question_embedding = await answer_cache.alookup(
+            userid,
+            corpus_version,
+            generated_question,
+            get_embedding().aembed_query if fast_path_documents is None else None,
+        )
+        if cached is not None:
+            # Pruning the memory may summarize it with a blocking LLM call
+            await asyncio.to_thread(
+                qa.memory.save_context, inputs, {"answer": cached["answer"]}
+            )
+            result = {
+                "question": question,
+                "chat_history": qa.memory.chat_memory.messages,
+                "answer": cached["answer"],
+                "source_documents": cached["source_documents"],
+                "generated_question": generated_question,
+                "cache_hit": similarity,
+            }
+            yield {
+                "generated_question": generated_question,
+                "source_documents": cached["source_documents"],
+                "cache_hit": similarity,
+            }
+            yield result
+            return
+
+    with track("retrieval") as span:
+        if fast_path_documents is not None:
+            docs = fast_path_documents
+        elif lexical is not None:
+            docs = await qa.retriever.afuse(generated_question, lexical)
+        else:
+            docs = await qa.retriever.aget_relevant_documents(generated_question)
+        span["chunks"] = len(docs)
+    yield {"generated_question": generated_question, "source_documents": docs}
+
+    tokens = asyncio.Queue()
+
+    async def generate():
+        try:
+            return await qa.combine_docs_chain.arun(
+                input_documents=docs,
+                question=generated_question,
+                chat_history=chat_history_str,
+                callbacks=[_AsyncTokenQueueHandler(tokens)],
+            )
+        finally:
+            await tokens.put(None)
+
+    generation = asyncio.ensure_future(generate())
+    try:
+        with track("generation", chunks=len(docs)) as span:
+            n_completion_tokens = 0
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    break
+                n_completion_tokens += 1
+                yield {"token": token}
+            answer = await generation
+            span["tokens"] = (
+                _prompt_tokens(docs, generated_question, chat_history_str)
+                + n_completion_tokens
+            )
+    finally:
+        generation.cancel()
+
+    # Pruning the memory may summarize it with a blocking LLM call
+    await asyncio.to_thread(qa.memory.save_context, inputs, {"answer": answer})
+    logger.info(f"Cache metrics: {get_cache_metrics()}")
+    if use_cache:
+        if (
+            question_embedding is None
+            and fast_path_documents is None
+            and answer_cache.similarity_threshold is not None
+        ):
+            # Already in query_embedding_cache from retrieval; fast path
+            # answers are stored without one and only match exactly
+            question_embedding = await get_embedding().aembed_query(generated_question)
+        answer_cache.store(
+            userid, corpus_version, generated_question, answer, docs, question_embedding
+        )
+    yield {
+        "question": question,
+        "chat_history": qa.memory.chat_memory.messages,
+        "answer": answer,
+        "source_documents": docs,
+        "generated_question": generated_question,
+    }